@@ -0,0 +1,61 @@
+###############################################################################
+'''
+    Compares the throughput of the statistical model and the gazetteer
+    entity extractors, and reports how well the gazetteer agrees with the
+    model, using the model's entities as the reference.
+
+    Usage:
+        python -m benchmark.extractors --gazetteer /tmp/gazetteer.txt --record-count 500
+'''
+###############################################################################
+import time
+from collections import Counter
+from typing import Dict, List
+
+import typer
+
+from ingest.processor import DataProcessor
+
+from .processor import load_posts
+
+
+def extract(processor: DataProcessor, texts: List[str]) -> List[Counter]:
+    '''Returns the entities found in each text, keyed by the entity strings.'''
+    start = time.perf_counter()
+    results = [Counter({processor.vocab[i]: c for i, c in ents.items()})
+               for ents in processor.process_texts(texts)]
+    elapsed = time.perf_counter() - start
+    print(f'{len(texts) / elapsed:,.1f} docs/sec')
+    return results
+
+
+def agreement(reference: List[Counter], candidate: List[Counter]) -> Dict[str, float]:
+    '''Micro-averaged precision, recall and f1 of the candidate entity counts.'''
+    matched = sum(sum((r & c).values()) for r, c in zip(reference, candidate))
+    found = sum(sum(c.values()) for c in candidate)
+    expected = sum(sum(r.values()) for r in reference)
+    precision = matched / found if found else 0.0
+    recall = matched / expected if expected else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'precision': precision, 'recall': recall, 'f1': f1}
+
+
+def runner(gazetteer: str = "/tmp/gazetteer.txt", csvfilepath: str = "/tmp/all_the_news/all-the-news-2-1.csv",
+           record_count: int = 500):
+    texts = [post['content'] for post in load_posts(csvfilepath, record_count)]
+
+    print('model:     ', end='')
+    reference = extract(DataProcessor(ner_only=True), texts)
+    print('gazetteer: ', end='')
+    candidate = extract(DataProcessor(extractor='gazetteer', gazetteer_path=gazetteer), texts)
+
+    scores = agreement(reference, candidate)
+    print('agreement: precision {precision:.1%}, recall {recall:.1%}, f1 {f1:.1%}'.format(**scores))
+
+
+def main():
+    typer.run(runner)
+
+
+if __name__ == "__main__":
+    main()
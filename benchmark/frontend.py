@@ -0,0 +1,60 @@
+###############################################################################
+'''
+    Compares the number of posts per second the frontend's request handlers
+    can put on the input queue using an AsyncConnector with a single
+    connection that puts one post per call, the same as the frontend's
+    original blocking connector, vs the default pooled and pipelined one.
+
+    A queue manager serving an input queue is started on port 50000.
+    Both connectors are called from coroutines.
+
+    Usage:
+        python -m benchmark.frontend --record-count 20000 --concurrency 64
+'''
+###############################################################################
+import asyncio
+import time
+
+import typer
+
+from ingest.frontend import AsyncConnector
+from ingest.messageq import QueueWrapper, create_queue_manager, register_manager
+
+post = {'content': 'The quick brown fox jumps over the lazy dog.', 'publication': 'benchmark'}
+
+
+def start_backend(port: int):
+    register_manager('iqueue', QueueWrapper(name='iqueue'))
+    server = create_queue_manager(port)
+    server.start()
+    return server
+
+
+async def bench_connector(connector: AsyncConnector, record_count: int, concurrency: int) -> float:
+    async def handler(num: int):
+        for _ in range(num):
+            await connector.put(post)
+
+    per_task = record_count // concurrency
+    start = time.perf_counter()
+    await asyncio.gather(*[handler(per_task) for _ in range(concurrency)])
+    return per_task * concurrency / (time.perf_counter() - start)
+
+
+def runner(record_count: int = 20_000, concurrency: int = 64):
+    server = start_backend(50_000)
+    try:
+        rate = asyncio.run(bench_connector(AsyncConnector(pool_size=1, max_pipeline=1), record_count, concurrency))
+        print(f'Single connection:    {rate:,.0f} posts/sec')
+        rate = asyncio.run(bench_connector(AsyncConnector(), record_count, concurrency))
+        print(f'Pooled and pipelined: {rate:,.0f} posts/sec')
+    finally:
+        server.shutdown()
+
+
+def main():
+    typer.run(runner)
+
+
+if __name__ == "__main__":
+    main()
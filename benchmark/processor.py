@@ -0,0 +1,65 @@
+###############################################################################
+'''
+    Compares the startup time, memory usage and per document latency of the
+    DataProcessor when loading the full spacy model vs the NER-only pipeline.
+
+    Each mode runs in its own process so that the memory numbers aren't
+    polluted by a previously loaded model.
+
+    Usage:
+        python -m benchmark.processor --record-count 500
+'''
+###############################################################################
+import resource
+import time
+from itertools import islice
+from multiprocessing import Pool
+from typing import Dict, List
+
+import typer
+
+from ingest.processor import DataProcessor
+from simulator.upload import get_data
+
+
+def load_posts(csvfilepath: str, record_count: int) -> List[Dict]:
+    rows = get_data(csvfilepath)
+    next(rows)  # Remove the header row
+    return list(islice(rows, record_count))
+
+
+def measure(ner_only: bool, posts: List[Dict]) -> Dict:
+    start = time.perf_counter()
+    processor = DataProcessor(ner_only=ner_only)
+    startup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for post in posts:
+        processor.process_message(post)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'mode': 'ner-only' if ner_only else 'full',
+        'startup_s': startup,
+        # ru_maxrss is reported in kilobytes on Linux.
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'per_doc_ms': elapsed / max(len(posts), 1) * 1000,
+    }
+
+
+def runner(csvfilepath: str = "/tmp/all_the_news/all-the-news-2-1.csv", record_count: int = 500):
+    posts = load_posts(csvfilepath, record_count)
+    for ner_only in (False, True):
+        # maxtasksperchild ensures each mode gets a fresh process.
+        with Pool(1, maxtasksperchild=1) as pool:
+            r = pool.apply(measure, (ner_only, posts))
+        print(f"{r['mode']:>8}: startup {r['startup_s']:.2f}s, "
+              f"max rss {r['max_rss_mb']:.0f}MB, {r['per_doc_ms']:.2f}ms/doc")
+
+
+def main():
+    typer.run(runner)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+###############################################################################
+'''
+    Measures the speedup from the DataProcessor's result cache on a dataset
+    where each article is repeated, like syndicated news, or a rerun of
+    simulator.upload.
+
+    Usage:
+        python -m benchmark.resultcache --record-count 500 --repeat 3
+'''
+###############################################################################
+import random
+import time
+
+import typer
+
+from ingest.processor import DataProcessor
+
+from .processor import load_posts
+
+
+def runner(csvfilepath: str = "/tmp/all_the_news/all-the-news-2-1.csv", record_count: int = 500,
+           repeat: int = 3, batch_size: int = 64, cache_mb: int = 64):
+    posts = load_posts(csvfilepath, record_count) * repeat
+    random.Random(0).shuffle(posts)
+
+    timings = {}
+    for cache_bytes in (0, cache_mb * 1024 * 1024):
+        processor = DataProcessor(ner_only=True, cache_bytes=cache_bytes)
+        start = time.perf_counter()
+        for start_idx in range(0, len(posts), batch_size):
+            list(processor.process_messages(posts[start_idx:start_idx + batch_size], batch_size))
+        timings[cache_bytes] = time.perf_counter() - start
+        stats = processor.cache_stats()
+        print(f"cache {'on' if cache_bytes else 'off':>3}: {len(posts) / timings[cache_bytes]:,.1f} docs/sec"
+              + (f", {stats['hit_rate']:.1%} hit rate" if stats else ''))
+
+    print(f"speedup: {timings[0] / timings[cache_mb * 1024 * 1024]:.2f}x")
+
+
+def main():
+    typer.run(runner)
+
+
+if __name__ == "__main__":
+    main()
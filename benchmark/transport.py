@@ -0,0 +1,71 @@
+###############################################################################
+'''
+    Compares the throughput and latency of the output queue's transports:
+    a multiprocessing.Queue, and a SharedMemoryQueue ring buffer.
+
+    Producer processes put batches of entity count messages, the same as
+    Workers flushing their cache, which are consumed by the main process.
+    Latency is the time from put to get, as each message carries the
+    monotonic clock time it was put.
+
+    Usage:
+        python -m benchmark.transport --producers 4 --batches 2000
+'''
+###############################################################################
+import time
+from multiprocessing import Process, Queue
+
+import typer
+
+from ingest.messageq import QueueWrapper
+from ingest.shmqueue import SharedMemoryQueue
+
+batch = [('benchmark', 'ent', f'{i:016x}', {'word': f'entity {i}', 'count': i}) for i in range(500)]
+
+
+def produce(oq: QueueWrapper, batches: int):
+    for _ in range(batches):
+        oq.put_batch([time.monotonic(), *batch])
+    oq.q.put('STOP')
+
+
+def measure(name: str, q, producers: int, batches: int):
+    oq = QueueWrapper(name, q=q)
+    procs = [Process(target=produce, args=(oq, batches)) for _ in range(producers)]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+
+    latencies, stopped = [], 0
+    while stopped < producers:
+        msg = oq.q.get()
+        if msg == 'STOP':
+            stopped += 1
+            continue
+        latencies.append(time.monotonic() - msg[0])
+    elapsed = time.perf_counter() - start
+    for p in procs:
+        p.join()
+
+    latencies.sort()
+    p50, p99 = latencies[len(latencies) // 2], latencies[int(0.99 * (len(latencies) - 1))]
+    print(f'{name:>6}: {len(latencies) / elapsed:>10,.0f} batches/sec, '
+          f'{len(latencies) * len(batch) / elapsed:>12,.0f} msgs/sec, '
+          f'latency p50 {p50 * 1000:.2f}ms, p99 {p99 * 1000:.2f}ms')
+
+
+def runner(producers: int = 4, batches: int = 2_000, shm_mb: int = 64):
+    measure('queue', Queue(), producers, batches)
+    shmq = SharedMemoryQueue(shm_mb * 1024 * 1024)
+    try:
+        measure('shm', shmq, producers, batches)
+    finally:
+        shmq.unlink()
+
+
+def main():
+    typer.run(runner)
+
+
+if __name__ == "__main__":
+    main()
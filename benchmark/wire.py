@@ -0,0 +1,55 @@
+###############################################################################
+'''
+    Compares the messages per second and bytes per message of each wire
+    format, for both kinds of queue message: posts on the input queue, and
+    batches of entity counts on the output queue.
+
+    Each message is encoded, put through the same pickling a
+    multiprocessing.Queue applies, and decoded again. "none" is the
+    default, where the message is only pickled by the queue.
+
+    Usage:
+        python -m benchmark.wire --iterations 20000
+'''
+###############################################################################
+import pickle
+import time
+from typing import Any
+
+import typer
+
+from ingest.wire import CODECS, get_codec
+
+post = {'content': 'The quick brown fox jumps over the lazy dog. ' * 100, 'publication': 'benchmark'}
+batch = [('benchmark', 'ent', f'{i:016x}', {'word': f'entity {i}', 'count': i}) for i in range(500)]
+
+
+def measure(name: str, msg: Any, iterations: int):
+    codec = get_codec(name) if name != 'none' else None
+    encode = codec.encode if codec else (lambda obj: obj)
+    decode = codec.decode if codec else (lambda obj: obj)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        data = pickle.dumps(encode(msg), protocol=pickle.HIGHEST_PROTOCOL)
+        decode(pickle.loads(data))
+    elapsed = time.perf_counter() - start
+    print(f'{name:>8}: {iterations / elapsed:>12,.0f} msgs/sec, {len(data):>8,} bytes/msg')
+
+
+def runner(iterations: int = 20_000):
+    for label, msg, num in (('post', post, iterations), ('batch', batch, iterations // 100)):
+        print(f'{label} messages')
+        for name in ('none', *CODECS):
+            try:
+                measure(name, msg, num)
+            except ImportError as ex:
+                print(f'{name:>8}: skipped, {ex}')
+
+
+def main():
+    typer.run(runner)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+###############################################################################
+'''
+    This module scales the number of worker and saver processes with load.
+
+    Each ProcessPool starts processes of a single type that consume the same
+    queue. On each tick the Autoscaler measures each pool's queue depth and
+    throughput per process, and resizes the pool to the number of processes
+    needed to drain the queue within drain_seconds.
+
+    Processes are retired by putting the sentinel STOP on their queue, so the
+    process that takes it flushes its cache, or persists its writes, before
+    it exits. Pools only shrink after needing fewer processes for cooldown
+    seconds, so short lulls don't cause processes to be retired and restarted.
+
+'''
+###############################################################################
+import math
+import time
+from multiprocessing import Process
+from typing import Callable, List
+
+from .debugging import app_logger as log
+from .messageq import QueueWrapper
+
+
+def desired_procs(depth: int, rate_per_proc: float, current: int, min_procs: int, max_procs: int,
+                  drain_seconds: float) -> int:
+    '''Returns the number of processes needed to consume depth messages within
+    drain_seconds, when each process consumes rate_per_proc messages per second.
+    Until a rate is measured the current number of processes is kept,
+    unless the queue is empty. The result is bounded by min_procs and max_procs.
+    '''
+    if rate_per_proc > 0:
+        needed = math.ceil(depth / (rate_per_proc * drain_seconds))
+    else:
+        needed = current if depth else min_procs
+    return max(min_procs, min(max_procs, needed))
+
+
+class ProcessPool(object):
+    '''ProcessPool starts and retires processes that consume the given queue.
+    procs is modified in place, so the same list can be given to the shutdown handlers.
+    '''
+
+    def __init__(self, name: str, proc: Callable[..., Process], proc_args: List[object], queue: QueueWrapper,
+                 min_procs: int, max_procs: int, procs: List[Process] = None):
+        self.name: str = name
+        self.proc = proc
+        self.proc_args: List[object] = proc_args
+        self.queue: QueueWrapper = queue
+        self.min_procs: int = min_procs
+        self.max_procs: int = max_procs
+        self.procs: List[Process] = procs if procs is not None else []
+        # The number of STOPs put on the queue that haven't been taken yet.
+        self._retiring: int = 0
+
+    def __len__(self) -> int:
+        '''Returns the number of processes that aren't retiring.'''
+        return len(self.procs) - self._retiring
+
+    def reap(self):
+        '''Removes the processes that have exited.
+        Only processes that exited cleanly took a STOP off the queue. The STOP
+        meant for a process that crashed is still queued, and will retire another.
+        '''
+        alive = [p for p in self.procs if p.is_alive()]
+        if len(alive) == len(self.procs):
+            return
+        stopped = 0
+        for p in self.procs:
+            if not p.is_alive():
+                p.join()
+                if p.exitcode == 0:
+                    stopped += 1
+                else:
+                    log.error(f'{self.name} process {p.pid} exited with code {p.exitcode}')
+        self.procs[:] = alive
+        self._retiring = max(self._retiring - stopped, 0)
+
+    def spawn(self, num: int):
+        log.info(f'starting {num} {self.name} process(es)')
+        for _ in range(num):
+            p = self.proc(*self.proc_args)
+            p.start()
+            self.procs.append(p)
+
+    def retire(self, num: int):
+        log.info(f'retiring {num} {self.name} process(es)')
+        for _ in range(num):
+            self.queue.q.put('STOP')
+        self._retiring += num
+
+    def resize(self, num: int):
+        if num > len(self):
+            self.spawn(num - len(self))
+        elif num < len(self):
+            self.retire(len(self) - num)
+
+
+class Autoscaler(object):
+    '''Autoscaler resizes each pool to drain its queue within drain_seconds.
+    Call tick every few seconds, for example from ShutdownWatcher.serve_forever.
+    '''
+
+    def __init__(self, pools: List[ProcessPool], drain_seconds: float = 30.0, cooldown: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.pools: List[ProcessPool] = pools
+        self.drain_seconds: float = drain_seconds
+        self.cooldown: float = cooldown
+        self._clock = clock
+        now = clock()
+        self._last_tick = {pool.name: now for pool in pools}
+        self._last_consumed = {pool.name: pool.queue.consumed() for pool in pools}
+        # The time each pool started needing fewer processes, if it does.
+        self._shrink_since = {}
+
+    def start(self):
+        '''Starts each pool's minimum number of processes.'''
+        for pool in self.pools:
+            pool.resize(pool.min_procs)
+
+    def tick(self):
+        for pool in self.pools:
+            pool.reap()
+            now, consumed = self._clock(), pool.queue.consumed()
+            elapsed = now - self._last_tick[pool.name]
+            rate = (consumed - self._last_consumed[pool.name]) / elapsed if elapsed > 0 else 0.0
+            self._last_tick[pool.name], self._last_consumed[pool.name] = now, consumed
+
+            current, depth = len(pool), pool.queue.depth()
+            rate_per_proc = rate / current if current else 0.0
+            desired = desired_procs(depth, rate_per_proc, current, pool.min_procs, pool.max_procs, self.drain_seconds)
+            log.debug(f'{pool.name}: depth {depth}, {rate_per_proc:.1f} msgs/sec per process, '
+                      f'{current} process(es), {desired} desired')
+
+            if desired >= current:
+                self._shrink_since.pop(pool.name, None)
+                if desired > current:
+                    pool.resize(desired)
+            elif now - self._shrink_since.setdefault(pool.name, now) >= self.cooldown:
+                self._shrink_since.pop(pool.name)
+                pool.resize(desired)
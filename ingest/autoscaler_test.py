@@ -0,0 +1,165 @@
+import pytest
+from ingest.autoscaler import Autoscaler, ProcessPool, desired_procs
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+class Proc:
+    '''Stands in for a Worker, which exits once it takes STOP off its queue.'''
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.started = False
+        self.crashed = False
+        self.pid = id(self)
+
+    def start(self):
+        self.started = True
+
+    def crash(self):
+        self.crashed = True
+
+    def is_alive(self):
+        return self.started and not self.crashed and self not in self.queue.stopped
+
+    @property
+    def exitcode(self):
+        if self.is_alive():
+            return None
+        return 1 if self.crashed else 0
+
+    def join(self):
+        pass
+
+
+class Queue:
+
+    def __init__(self):
+        self.messages = []
+        self.stopped = []
+        self.total = 0
+        self.q = self
+
+    def put(self, msg):
+        self.messages.append(msg)
+
+    def depth(self):
+        return len(self.messages)
+
+    def consumed(self):
+        return self.total
+
+    def consume(self, num, procs=()):
+        '''Takes num messages off the queue. A STOP stops one of the procs.'''
+        for _ in range(num):
+            if self.messages.pop(0) == 'STOP':
+                self.stopped.append(next(p for p in procs if p not in self.stopped))
+            self.total += 1
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(scope='function')
+def queue():
+    return Queue()
+
+
+@pytest.fixture(scope='function')
+def pool(queue):
+    return ProcessPool('worker', Proc, [queue], queue, min_procs=1, max_procs=4)
+
+
+@pytest.mark.parametrize('depth, rate, current, expected', [
+    (0, 0.0, 2, 1),         # Idle queues shrink to the minimum.
+    (100, 0.0, 2, 2),       # Without a measured rate, keep the current size.
+    (100, 0.0, 0, 1),       # Unless no processes are running.
+    (600, 10.0, 1, 2),      # 600 messages at 10 per second take 2 processes 30 seconds.
+    (6_000, 10.0, 2, 4),    # Bounded by max_procs.
+    (10, 10.0, 3, 1),       # Bounded by min_procs.
+])
+def test_desired_procs(depth, rate, current, expected):
+    assert desired_procs(depth, rate, current, 1, 4, 30.0) == expected
+
+
+def test_pool_resize(pool, queue):
+    pool.resize(3)
+    assert len(pool) == 3
+    assert all(p.started for p in pool.procs)
+
+    pool.resize(1)
+    assert queue.messages == ['STOP', 'STOP']
+    assert len(pool) == 1
+    assert len(pool.procs) == 3
+
+    queue.consume(2, pool.procs)
+    pool.reap()
+    assert len(pool.procs) == 1
+    assert len(pool) == 1
+
+
+def test_pool_reaps_crashed_procs(pool, queue):
+    pool.spawn(2)
+    pool.procs[0].crash()
+    pool.reap()
+    assert len(pool) == 1
+    assert len(pool.procs) == 1
+
+
+def test_pool_reaps_crashed_procs_while_retiring(pool, queue):
+    pool.spawn(3)
+    pool.resize(2)
+    assert queue.messages == ['STOP']
+
+    # The process that crashed didn't take the STOP, which retires another.
+    pool.procs[0].crash()
+    pool.reap()
+    assert len(pool.procs) == 2
+    assert len(pool) == 1
+    pool.resize(2)
+    assert len(pool.procs) == 3
+
+    queue.consume(1, pool.procs)
+    pool.reap()
+    assert len(pool.procs) == 2
+    assert len(pool) == 2
+
+
+def test_autoscaler_scales_up_and_down(pool, queue):
+    clock = Clock()
+    autoscaler = Autoscaler([pool], drain_seconds=30.0, cooldown=60.0, clock=clock)
+    autoscaler.start()
+    assert len(pool) == 1
+
+    # One process consumes 10 messages per second, while 1,200 are queued.
+    for _ in range(1_300):
+        queue.put('post')
+    queue.consume(100)
+    clock.now += 10.0
+    autoscaler.tick()
+    assert len(pool) == 4
+
+    # Once the queue is empty the pool only shrinks after the cooldown.
+    queue.consume(1_200)
+    clock.now += 10.0
+    autoscaler.tick()
+    assert len(pool) == 4
+    clock.now += 60.0
+    autoscaler.tick()
+    assert len(pool) == 1
+    assert queue.messages == ['STOP'] * 3
@@ -16,18 +16,25 @@
 
 '''
 ###############################################################################
+import gc
 import os
 import signal
+import time
 from collections import defaultdict
 from multiprocessing import Process
 from typing import Dict, List, Tuple
 
+from .autoscaler import Autoscaler, ProcessPool
+from .combiner import WriteCombiner
 from .debugging import app_logger as log
 from .messageq import QueueWrapper, create_queue_manager, register_manager
 from .models import ProcessedPost
-from .persistence import get_database_client, persist, persist_no_op
-from .processor import DataProcessor
+from .persistence import get_database_client, persist_batch, persist_no_op
+from .processor import EXTRACTORS, DataProcessor
+from .shmqueue import SharedMemoryQueue
+from .spool import Spool
 from .shutdownwatcher import ShutdownWatcher
+from .wire import CODECS
 
 
 class Worker(Process):
@@ -35,10 +42,36 @@ class Worker(Process):
     fetching data from the input queue and extracting known entities.
     '''
 
-    def __init__(self, inq: QueueWrapper, outq: QueueWrapper, cache_size: int = 25_000):
+    # A rough estimate of the bytes used by each entity held in the cache:
+    # the Counter's hash table entry, the entity id, and its count.
+    CACHE_ENTRY_BYTES = 100
+    # The max number of messages put on the output queue together when flushing.
+    FLUSH_CHUNK_SIZE = 500
+    # The max number of seconds an idle worker waits for messages before checking
+    # whether its cache should be flushed, for example because SIGUSR1 was received.
+    IDLE_WAIT = 1.0
+
+    def __init__(self, inq: QueueWrapper, outq: QueueWrapper, cache_size: int = 25_000,
+                 cache_bytes: int = 0, cache_age: float = 0.0,
+                 batch_size: int = 1, batch_latency: float = 0.05,
+                 processor: DataProcessor = None, processor_options: Dict = None):
         self.iq: QueueWrapper = inq
         self.oq: QueueWrapper = outq
+        # The cache is flushed when it holds cache_size messages, uses an estimated
+        # cache_bytes of memory, or its oldest message was cached cache_age seconds ago.
+        # Zero values disable the memory and age limits.
         self._cache_size: int = cache_size
+        self._cache_bytes: int = cache_bytes
+        self._cache_age: float = cache_age
+        self._flush_requested: bool = False
+        # The max number of messages pulled off the input queue and processed together,
+        # and the max number of seconds spent waiting for a batch to fill up.
+        self._batch_size: int = batch_size
+        self._batch_latency: float = batch_latency
+        # A DataProcessor loaded by the parent process before forking, if any.
+        # Otherwise one is created in run() using the processor_options.
+        self.processor: DataProcessor = processor
+        self._processor_options: Dict = processor_options or {}
         self.reset_cache()
         super(Worker, self).__init__()
 
@@ -54,37 +87,105 @@ class Worker(Process):
             self._count += incr_num
         return self._count
 
+    def request_flush(self, *args):
+        '''Signal handler used to flush the cache once the current batch is processed.'''
+        self._flush_requested = True
+
     def reset_cache(self):
         self._cache = defaultdict(ProcessedPost)
         self._count = 0
+        # The estimated size of the cache, the number of messages merged into
+        # an already cached publication, and the time the oldest message was cached.
+        self._bytes = 0
+        self._hits = 0
+        self._oldest = None
+        self._flush_requested = False
 
     def cache(self, msg: ProcessedPost) -> int:
         '''Caches messages until flush_cache is called.
         Returns the number of currently cached values.
         '''
-        self._cache[msg.pub_key] += msg
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if msg.pub_key in self._cache:
+            self._hits += 1
+
+        post = self._cache[msg.pub_key]
+        size = len(post.entities)
+        post += msg
+        self._bytes += (len(post.entities) - size) * self.CACHE_ENTRY_BYTES
         return self.count(1)
 
+    def cache_stats(self) -> Dict[str, float]:
+        return {
+            'messages': self._count,
+            'publications': len(self._cache),
+            'hits': self._hits,
+            'bytes': self._bytes,
+            'age': 0.0 if self._oldest is None else time.monotonic() - self._oldest,
+        }
+
+    def should_flush(self) -> bool:
+        '''Returns True if any of the cache's limits are reached, a flush was requested,
+        or the processor's entity vocab is full and needs to be reset.
+        '''
+        stats = self.cache_stats()
+        vocab_full = self.processor is not None and self.processor.vocab_full()
+        return self._flush_requested or vocab_full or stats['messages'] >= self._cache_size or \
+            bool(self._cache_bytes and stats['bytes'] >= self._cache_bytes) or \
+            bool(self._cache_age and stats['messages'] and stats['age'] >= self._cache_age)
+
     def flush_cache(self):
-        log.info('flushing cache')
-        for post in self._cache.values():
-            self.oq.put_many(post.transform_for_database())
+        log.info('flushing cache: {messages} messages, {publications} publications, '
+                 '{hits} hits, ~{bytes} bytes, {age:.1f}s old'.format(**self.cache_stats()))
+        if self.processor.cache is not None:
+            log.info('result cache: {hit_rate:.1%} hit rate, {entries} entries, '
+                     '~{bytes} bytes'.format(**self.processor.cache_stats()))
+        log.info(f'entity vocab: {len(self.processor.vocab)} entities, ~{self.processor.vocab.bytes} bytes')
+        # Each publication's messages are created lazily, sent in chunks, and
+        # the publication is removed from the cache as soon as it's sent.
+        # That prevents memory usage from spiking while flushing.
+        while self._cache:
+            _, post = self._cache.popitem()
+            self.oq.put_batch(post.stream_for_database(vocab=self.processor.vocab), self.FLUSH_CHUNK_SIZE)
+        # The cached messages no longer need to be recovered from the spool.
+        # Messages from the current batch that aren't processed yet stay unacknowledged.
+        self.iq.ack(self._count)
         self.reset_cache()
+        # Once the cache is empty, none of the vocab's ids are held by this worker.
+        if self.processor.vocab_full():
+            self.processor.reset_vocab()
 
     def run(self):
-        # Register the shutdown handler for this process.
+        # Register the shutdown and flush handlers for this process.
         signal.signal(signal.SIGTERM, self.shutdown)
+        signal.signal(signal.SIGUSR1, self.request_flush)
         # Only the worker processes need to use the data processor.
         # The data processor uses Spacy for its processing.
         # Spacy can take up a bit of memory when loaded. The amount depends on
         # which model is used. If we instantiate in __init__ the process
         # that creates Workers ends up using more memory than needed.
-        processor = DataProcessor()
-        # self.iq.get() is a blocking call.
-        # This will repeatedly call get and wait for an object to be
-        # pulled from the queue until the get call returns the sentinel 'STOP'
-        for msg in iter(self.iq.get, 'STOP'):
-            if self.cache(processor.process_message(msg)) == self._cache_size:
+        # The exception is when the parent preloaded the model before forking,
+        # in which case the model's memory is shared copy-on-write.
+        self.processor = processor = self.processor or DataProcessor(**self._processor_options)
+        # self.iq.get_many() is a blocking call.
+        # This will repeatedly call get_many and wait for a batch of objects to
+        # be pulled from the queue until the batch ends with the sentinel 'STOP'
+        # Waiting is limited so idle workers still flush when the age limit
+        # is reached, or a flush is requested.
+        wait = min(self._cache_age, self.IDLE_WAIT) if self._cache_age else self.IDLE_WAIT
+        while True:
+            msgs = self.iq.get_many(self._batch_size, self._batch_latency, wait)
+            stopped = bool(msgs) and msgs[-1] == 'STOP'
+            if stopped:
+                msgs.pop()
+            for msg in processor.process_messages(msgs, self._batch_size):
+                self.cache(msg)
+                if self.should_flush():
+                    self.flush_cache()
+            if stopped:
+                break
+            if self.should_flush():
                 self.flush_cache()
         # Leaving the process with a status code of 0, if all went well.
         self.flush_cache()
@@ -92,13 +193,24 @@ class Worker(Process):
 
 
 class Saver(Process):
-    '''Saver pulls messages off the queue and passes the message and client to the persist_fn.'''
+    '''Saver pulls batches of messages off the queue and passes the client and
+    the list of messages to the persist_fn.
+    '''
 
-    def __init__(self, q: QueueWrapper, client, persist_fn):
+    def __init__(self, q: QueueWrapper, client, persist_fn, batch_size: int = 500, batch_latency: float = 0.5,
+                 combine_size: int = 5_000, combine_window: float = 2.0):
         assert callable(persist_fn)
         self.q: QueueWrapper = q
         self.client = client
         self.persist_fn = persist_fn
+        # The number of messages to accumulate before persisting them,
+        # and the max number of seconds spent waiting to accumulate them.
+        self._batch_size: int = batch_size
+        self._batch_latency: float = batch_latency
+        # The max number of combined documents, and the max number of seconds
+        # messages are held for combining before being persisted.
+        self._combine_size: int = combine_size
+        self._combine_window: float = combine_window
         super(Saver, self).__init__()
 
     def shutdown(self, *args):
@@ -107,8 +219,21 @@ class Saver(Process):
 
     def run(self):
         signal.signal(signal.SIGTERM, self.shutdown)
-        for msg in iter(self.q.get, 'STOP'):
-            self.persist_fn(self.client, *msg)
+        combiner = WriteCombiner(self._combine_size, self._combine_window)
+        # Workers put each publication's messages on the queue as a batch.
+        # Messages for the same document are combined by summing their counts
+        # and persisted once the combiner is full or its window has passed.
+        # Waiting at most one window for a batch ensures idle savers still flush.
+        while True:
+            msgs = self.q.get_batch(self._batch_size, self._batch_latency, wait=self._combine_window)
+            if msgs == 'STOP':
+                break
+            combiner.add(msgs)
+            if combiner.should_flush:
+                self.persist_fn(self.client, combiner.drain())
+        # Persist everything that's left before shutting down.
+        if combiner:
+            self.persist_fn(self.client, combiner.drain())
         exit(0)
 
 
@@ -121,15 +246,32 @@ def start_processes(proc_num: int, proc: Process, proc_args: List[object]) -> Li
     return procs
 
 
+def preload_processor(processor_options: Dict) -> DataProcessor:
+    '''Loads a DataProcessor in the current process so it can be shared with
+    Worker processes started afterwards. This relies on the fork start method
+    which is the default on Linux. The model's weights are shared copy-on-write,
+    so only one copy of the model resides in memory for the whole worker pool.
+
+    gc.freeze moves every tracked object into a permanent generation, which
+    prevents the garbage collector from touching (and therefore copying) the
+    shared memory pages in the child processes.
+    '''
+    processor = DataProcessor(**processor_options)
+    gc.freeze()
+    return processor
+
+
 def shutdown(q: QueueWrapper, procs: List[Process]):
     '''Shuts down the given processes using the following steps:
     1.) Disable writes to the given QueueWrapper
     2.) Send SIGTERM signals to each of the given processes
     3.) Calls join on the procs, blocking until they complete.
+    Processes that have already exited, for example because they were
+    retired by the autoscaler, are only joined.
     '''
     q.prevent_writes()
     log.info(f"sending SIGTERM to processes")
-    [os.kill(p.pid, signal.SIGTERM) for p in procs]
+    [os.kill(p.pid, signal.SIGTERM) for p in procs if p.is_alive()]
     log.info(f"joining processes")
     [p.join() for p in procs]
 
@@ -149,9 +291,42 @@ def main():
     parser_arguments = [
         ('--iproc_num', {'help': 'number of input queue workers', 'default': pcount, 'type': int}),  # noqa
         ('--oproc_num', {'help': 'number of output queue workers', 'default': pcount, 'type': int}),  # noqa
+        ('--autoscale', {'help': 'scale the number of workers and savers with load, up to iproc_num and oproc_num', 'action': 'store_true'}),  # noqa
+        ('--iproc_min', {'help': 'min number of input queue workers when autoscaling', 'default': 1, 'type': int}),  # noqa
+        ('--oproc_min', {'help': 'min number of output queue workers when autoscaling', 'default': 1, 'type': int}),  # noqa
+        ('--autoscale_interval', {'help': 'seconds between autoscaling decisions', 'default': 5.0, 'type': float}),  # noqa
+        ('--autoscale_drain', {'help': 'seconds in which the autoscaler aims to drain each queue', 'default': 30.0, 'type': float}),  # noqa
+        ('--autoscale_cooldown', {'help': 'seconds fewer processes must be needed before any are retired', 'default': 60.0, 'type': float}),  # noqa
         ('--iport', {'help': 'input queue port cross proc messaging', 'default': 50_000, 'type': int}),  # noqa
+        ('--ihost', {'help': 'input queue address to bind, use 0.0.0.0 for sharded deployments', 'default': '127.0.0.1'}),  # noqa
+        ('--iqueue_maxsize', {'help': 'max number of messages on the input queue, 0 for unbounded', 'default': 0, 'type': int}),  # noqa
+        ('--iqueue_high_watermark', {'help': 'input queue depth at which new messages are rejected, 0 to disable', 'default': 0, 'type': int}),  # noqa
+        ('--iqueue_low_watermark', {'help': 'input queue depth at which new messages are accepted again', 'default': 0, 'type': int}),  # noqa
+        ('--iqueue_codec', {'help': 'wire format used to encode input queue messages, defaults to pickle', 'default': None, 'choices': list(CODECS)}),  # noqa
+        ('--oqueue_codec', {'help': 'wire format used to encode output queue messages, defaults to pickle', 'default': None, 'choices': list(CODECS)}),  # noqa
+        ('--oqueue_transport', {'help': 'transport used between workers and savers: a multiprocessing queue, or a shared memory ring buffer', 'default': 'queue', 'choices': ['queue', 'shm']}),  # noqa
+        ('--oqueue_shm_mb', {'help': 'megabytes used by the shared memory ring buffer', 'default': 64, 'type': int}),  # noqa
+        ('--spool_dir', {'help': 'directory of the write-ahead spool for the input queue, disabled by default', 'default': None}),  # noqa
+        ('--spool_segment_mb', {'help': 'megabytes written to each spool segment file', 'default': 64, 'type': int}),  # noqa
+        ('--spool_sync_ms', {'help': 'max milliseconds before spooled messages are fsynced', 'default': 50, 'type': int}),  # noqa
         ('--no_persistence', {'help': 'disable database persistence', 'action': 'store_true'}),  # noqa
         ('--agg_cache_size', {'help': 'aggregator cache size', 'default': 25_000, 'type': int}),  # noqa
+        ('--agg_cache_mb', {'help': 'estimated aggregator cache memory limit in megabytes, 0 to disable', 'default': 0, 'type': int}),  # noqa
+        ('--agg_cache_age', {'help': 'max seconds messages are cached by the aggregator, 0 to disable', 'default': 0, 'type': float}),  # noqa
+        ('--batch_size', {'help': 'max number of messages processed together by a worker', 'default': 1, 'type': int}),  # noqa
+        ('--batch_latency', {'help': 'max milliseconds a worker waits to fill a batch', 'default': 50, 'type': int}),  # noqa
+        ('--save_batch_size', {'help': 'number of messages a saver persists together', 'default': 500, 'type': int}),  # noqa
+        ('--save_batch_latency', {'help': 'max milliseconds a saver waits to fill a batch', 'default': 500, 'type': int}),  # noqa
+        ('--combine_size', {'help': 'max number of documents a saver combines writes for', 'default': 5_000, 'type': int}),  # noqa
+        ('--combine_window', {'help': 'max milliseconds a saver holds writes for combining', 'default': 2_000, 'type': int}),  # noqa
+        ('--vocab_mb', {'help': 'estimated entity vocab memory limit in megabytes per worker, 0 to disable', 'default': 64, 'type': int}),  # noqa
+        ('--result_cache_mb', {'help': 'megabytes used by each worker to cache the entities of repeated texts, 0 to disable', 'default': 0, 'type': int}),  # noqa
+        ('--chunk_chars', {'help': 'split texts into chunks of up to this many characters, 0 to disable', 'default': 0, 'type': int}),  # noqa
+        ('--max_chars', {'help': 'truncate texts to this many characters, 0 for the model max', 'default': 0, 'type': int}),  # noqa
+        ('--extractor', {'help': 'entity extractor used by the workers', 'default': 'model', 'choices': EXTRACTORS}),  # noqa
+        ('--gazetteer', {'help': 'path of the gazetteer file used by the gazetteer extractor', 'default': '/tmp/gazetteer.txt'}),  # noqa
+        ('--preload_model', {'help': 'load the spacy model once and share it with forked workers', 'action': 'store_true'}),  # noqa
+        ('--ner_only', {'help': 'only load the spacy pipes required for entity recognition', 'action': 'store_true'}),  # noqa
     ]
 
     import argparse
@@ -161,34 +336,91 @@ def main():
 
     args = parser.parse_args()
 
+    if args.iqueue_low_watermark > args.iqueue_high_watermark:
+        parser.error('--iqueue_low_watermark must not exceed --iqueue_high_watermark')
+    if args.autoscale and not (0 < args.iproc_min <= args.iproc_num and 0 < args.oproc_min <= args.oproc_num):
+        parser.error('--iproc_min and --oproc_min must be between 1 and --iproc_num and --oproc_num')
+
     iproc_num = args.iproc_num
     oproc_num = args.oproc_num
     iport = args.iport
     cache_sz = args.agg_cache_size
+    cache_bytes = args.agg_cache_mb * 1024 * 1024
+    cache_age = args.agg_cache_age
+    batch_sz = args.batch_size
+    batch_latency = args.batch_latency / 1000
+    save_batch_sz = args.save_batch_size
+    save_batch_latency = args.save_batch_latency / 1000
+    combine_sz = args.combine_size
+    combine_window = args.combine_window / 1000
     # A tuple containing the db client and method for persisting message
     # For testing, the no_persistence flag allows us to use a null client with a no op function.
     if args.no_persistence:
         persistable = (None, persist_no_op)
     else:
-        persistable = (get_database_client(), persist)
+        persistable = (get_database_client(), persist_batch)
 
     # Setup the input queue, aggregate queue, and output queue
-    iq = QueueWrapper(name="iqueue")
-    oq = QueueWrapper(name="oqueue")
+    iq = QueueWrapper(
+        name="iqueue",
+        maxsize=args.iqueue_maxsize,
+        high_watermark=args.iqueue_high_watermark,
+        low_watermark=args.iqueue_low_watermark,
+        codec=args.iqueue_codec,
+        spool=Spool(args.spool_dir, args.spool_segment_mb * 1024 * 1024, args.spool_sync_ms / 1000) if args.spool_dir else None,
+    )
+    # Recover the messages left in the spool by the previous run,
+    # before the queue manager process is forked.
+    iq.replay()
+    if args.oqueue_transport == 'shm':
+        shmq = SharedMemoryQueue(args.oqueue_shm_mb * 1024 * 1024)
+        # Registered before the shutdown handlers, so it runs after they've joined the processes.
+        import atexit
+        atexit.register(shmq.unlink)
+    else:
+        shmq = None
+    oq = QueueWrapper(name="oqueue", q=shmq, codec=args.oqueue_codec)
 
     # Register and start the input queue manager for remote connections.
     # This allows the frontend to put messages on the queue
     register_manager("iqueue", iq)
-    iserver = create_queue_manager(iport)
+    iserver = create_queue_manager(iport, args.ihost)
     iserver.start()
 
+    # Options used by each worker to create its DataProcessor.
+    processor_options = {
+        'ner_only': args.ner_only,
+        'cache_bytes': args.result_cache_mb * 1024 * 1024,
+        'chunk_chars': args.chunk_chars,
+        'max_chars': args.max_chars,
+        'extractor': args.extractor,
+        'gazetteer_path': args.gazetteer,
+        'vocab_bytes': args.vocab_mb * 1024 * 1024,
+    }
+    # Optionally load the model before forking the workers.
+    processor = preload_processor(processor_options) if args.preload_model else None
+
     # Start up the worker/saver processes
-    iprocs = start_processes(iproc_num, Worker, [iq, oq, cache_sz])
-    oprocs = start_processes(oproc_num, Saver, [oq, *persistable])
+    worker_args = [iq, oq, cache_sz, cache_bytes, cache_age, batch_sz, batch_latency, processor, processor_options]
+    saver_args = [oq, *persistable, save_batch_sz, save_batch_latency, combine_sz, combine_window]
+    if args.autoscale:
+        # The pools add and remove processes from these lists in place.
+        iprocs, oprocs = [], []
+        autoscaler = Autoscaler([
+            ProcessPool('worker', Worker, worker_args, iq, args.iproc_min, iproc_num, iprocs),
+            ProcessPool('saver', Saver, saver_args, oq, args.oproc_min, oproc_num, oprocs),
+        ], args.autoscale_drain, args.autoscale_cooldown)
+        autoscaler.start()
+    else:
+        iprocs = start_processes(iproc_num, Worker, worker_args)
+        oprocs = start_processes(oproc_num, Saver, saver_args)
 
     # Setup the shutdown handlers to gracefully shutdown the processes.
     register_shutdown_handlers([iq, oq], [iprocs, oprocs])
 
     with ShutdownWatcher() as watcher:
-        watcher.serve_forever()
+        if args.autoscale:
+            watcher.serve_forever(autoscaler.tick, args.autoscale_interval)
+        else:
+            watcher.serve_forever()
     exit(0)
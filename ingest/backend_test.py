@@ -0,0 +1,97 @@
+from collections import Counter
+
+import pytest
+from ingest.backend import Worker
+from ingest.messageq import QueueWrapper
+from ingest.models import ProcessedPost
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+@pytest.fixture(scope='function')
+def worker():
+    # The worker isn't started, so no processor is needed.
+    return Worker(QueueWrapper('inq'), QueueWrapper('outq'), cache_size=3)
+
+
+def post(publication, *ids):
+    return ProcessedPost(publication=publication, entities=Counter(ids), article_count=1)
+
+
+def test_cache_stats(worker):
+    worker.cache(post('pub0', 0, 1))
+    worker.cache(post('Pub0 ', 1, 2))
+    worker.cache(post('pub1', 0))
+    stats = worker.cache_stats()
+    assert stats['messages'] == 3
+    assert stats['publications'] == 2
+    assert stats['hits'] == 1
+    assert stats['bytes'] == 4 * Worker.CACHE_ENTRY_BYTES
+    assert stats['age'] >= 0.0
+
+
+def test_should_flush_count(worker):
+    worker.cache(post('pub0', 0))
+    worker.cache(post('pub0', 0))
+    assert not worker.should_flush()
+    worker.cache(post('pub0', 0))
+    assert worker.should_flush()
+
+
+def test_should_flush_bytes(worker):
+    worker._cache_bytes = 2 * Worker.CACHE_ENTRY_BYTES
+    worker.cache(post('pub0', 0))
+    worker.cache(post('pub0', 0))
+    assert not worker.should_flush()
+    worker.cache(post('pub0', 1))
+    assert worker.should_flush()
+
+
+def test_should_flush_age(worker, monkeypatch):
+    worker._cache_age = 10.0
+    assert not worker.should_flush()
+    worker.cache(post('pub0', 0))
+    assert not worker.should_flush()
+    monkeypatch.setattr(worker, '_oldest', worker._oldest - 10.0)
+    assert worker.should_flush()
+
+
+def test_should_flush_requested(worker):
+    assert not worker.should_flush()
+    worker.request_flush()
+    assert worker.should_flush()
+
+
+def test_reset_cache(worker):
+    worker.cache(post('pub0', 0))
+    worker.cache(post('pub0', 1))
+    worker.request_flush()
+    worker.reset_cache()
+    assert worker.cache_stats() == {'messages': 0, 'publications': 0, 'hits': 0, 'bytes': 0, 'age': 0.0}
+    assert not worker.should_flush()
+
+
+class Processor:
+    '''Stands in for the DataProcessor's entity vocab limit.'''
+
+    def __init__(self, full):
+        self.full = full
+
+    def vocab_full(self):
+        return self.full
+
+
+def test_should_flush_vocab_full(worker):
+    worker.processor = Processor(full=False)
+    assert not worker.should_flush()
+    worker.processor = Processor(full=True)
+    assert worker.should_flush()
@@ -0,0 +1,68 @@
+###############################################################################
+'''
+    This module provides a write combiner used to pre-aggregate the increment
+    messages created by Workers before they're persisted.
+
+    Workers flush independently of each other, so the same document is often
+    incremented by several messages within a few seconds. Summing the counts
+    for each document before persisting results in far fewer writes.
+
+'''
+###############################################################################
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from .debugging import app_logger as log
+
+
+class WriteCombiner(object):
+    '''WriteCombiner buffers increment messages, keyed by the document they
+    increment: (publication, collection, doc_id), and sums their counts.
+    '''
+
+    def __init__(self, max_docs: int = 5_000, max_age: float = 2.0, clock: Callable[[], float] = time.monotonic):
+        self._max_docs: int = max_docs
+        self._max_age: float = max_age
+        self._clock = clock
+        self._buffer: Dict[Tuple[str, str, str], Dict] = {}
+        self._oldest: float = None
+        # The number of messages added and the number combined with a buffered message.
+        self.added: int = 0
+        self.combined: int = 0
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def add(self, msgs: Iterable[Tuple[str, str, str, Dict]]) -> int:
+        '''Adds the messages to the buffer and returns the number of buffered documents.'''
+        for pubname, collname, doc_id, document_dict in msgs:
+            key = (pubname, collname, doc_id)
+            self.added += 1
+            if key in self._buffer:
+                doc = self._buffer[key]
+                doc.update({**document_dict, 'count': doc['count'] + document_dict['count']})
+                self.combined += 1
+            else:
+                self._buffer[key] = dict(document_dict)
+
+        if self._oldest is None and self._buffer:
+            self._oldest = self._clock()
+        return len(self._buffer)
+
+    @property
+    def age(self) -> float:
+        '''Read-only property with the number of seconds since the oldest buffered message was added.'''
+        return 0.0 if self._oldest is None else self._clock() - self._oldest
+
+    @property
+    def should_flush(self) -> bool:
+        '''Read-only property indicating if the buffer is full, or its oldest message is too old.'''
+        return bool(self._buffer) and (len(self._buffer) >= self._max_docs or self.age >= self._max_age)
+
+    def drain(self) -> List[Tuple[str, str, str, Dict]]:
+        '''Returns the combined messages and empties the buffer.'''
+        msgs = [(*key, doc) for key, doc in self._buffer.items()]
+        log.debug(f'draining {len(msgs)} combined message(s), {self.combined} of {self.added} added messages combined')
+        self._buffer = {}
+        self._oldest = None
+        return msgs
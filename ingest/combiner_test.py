@@ -0,0 +1,72 @@
+import pytest
+from ingest.combiner import WriteCombiner
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(scope='function')
+def clock():
+    return Clock()
+
+
+@pytest.fixture(scope='function')
+def combiner(clock):
+    return WriteCombiner(max_docs=3, max_age=5.0, clock=clock)
+
+
+def test_add_combines_counts(combiner):
+    assert combiner.add([
+        ('pub0', 'ent', 'id0', {'word': 'ent0', 'count': 1}),
+        ('pub0', 'ent', 'id0', {'word': 'ent0', 'count': 2}),
+        ('pub0', None, None, {'count': 3}),
+        ('pub0', None, None, {'count': 4}),
+    ]) == 2
+    assert combiner.combined == 2
+    assert sorted(combiner.drain(), key=str) == sorted([
+        ('pub0', 'ent', 'id0', {'word': 'ent0', 'count': 3}),
+        ('pub0', None, None, {'count': 7}),
+    ], key=str)
+    assert len(combiner) == 0
+
+
+def test_add_does_not_mutate_messages(combiner):
+    doc = {'word': 'ent0', 'count': 1}
+    combiner.add([('pub0', 'ent', 'id0', doc), ('pub0', 'ent', 'id0', doc)])
+    assert doc['count'] == 1
+
+
+def test_should_flush_on_size(combiner):
+    combiner.add([('pub0', 'ent', f'id{i}', {'count': 1}) for i in range(2)])
+    assert not combiner.should_flush
+    combiner.add([('pub0', 'ent', 'id2', {'count': 1})])
+    assert combiner.should_flush
+
+
+def test_should_flush_on_age(combiner, clock):
+    assert not combiner.should_flush
+    combiner.add([('pub0', 'ent', 'id0', {'count': 1})])
+    clock.now = 4.9
+    assert not combiner.should_flush
+    clock.now = 5.0
+    assert combiner.should_flush
+    combiner.drain()
+    assert combiner.age == 0.0
+    assert not combiner.should_flush
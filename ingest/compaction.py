@@ -0,0 +1,115 @@
+###############################################################################
+'''
+    This module merges duplicate entity documents.
+
+    Entity documents used to be stored using str(hash(word)) as the doc id.
+    Python's string hashing is randomized per process, so the same entity
+    was stored under a different id by each Worker, and after each restart.
+
+    Compaction groups each publication's entity documents by their stable id
+    from models.entity_doc_id. Counts from documents with other ids are added
+    to the stable document, and those documents are deleted.
+
+    Run it after deploying Workers that use stable ids, so no new documents
+    are written using the old ids:
+        compactentities --dry_run
+'''
+###############################################################################
+from collections import defaultdict
+from typing import Iterable, List
+
+from google.cloud import firestore
+
+from .debugging import app_logger as log
+from .models import entity_doc_id, normalize_entity
+from .persistence import MAX_BATCH_WRITES, WRITES_PER_INCREMENT, get_database_client
+
+
+class BatchWriter(object):
+    '''Batches the writes used to merge documents, committing before a batch
+    would exceed max_writes.
+
+    Each merge's increment is committed together with the deletes of the
+    documents it counts. So an interrupted compaction never loses a count,
+    or counts a document twice when it's run again.
+    '''
+
+    def __init__(self, client, max_writes: int = MAX_BATCH_WRITES, dry_run: bool = False):
+        self.client = client
+        self.max_writes: int = max_writes
+        self.dry_run: bool = dry_run
+        self.writes: int = 0
+        self._batch = client.batch()
+        self._pending: int = 0
+
+    def merge(self, ref, word: str, duplicates: List):
+        '''Adds the counts of the duplicate documents to the document at ref,
+        and deletes the duplicates.
+        Duplicates that don't fit in a single batch are merged in several parts.
+        '''
+        part_size = self.max_writes - WRITES_PER_INCREMENT
+        for start in range(0, len(duplicates), part_size):
+            part = duplicates[start:start + part_size]
+            writes = WRITES_PER_INCREMENT + len(part)
+            if self._pending + writes > self.max_writes:
+                self.commit()
+
+            count = sum(doc.get('count') for doc in part)
+            self._batch.set(ref, {'word': word, 'count': firestore.Increment(count)}, merge=True)
+            for doc in part:
+                self._batch.delete(doc.reference)
+            self.writes += writes
+            self._pending += writes
+
+    def commit(self):
+        if self._pending and not self.dry_run:
+            self._batch.commit()
+        self._batch = self.client.batch()
+        self._pending = 0
+
+
+def compact_publication(client, pubname: str, writer: BatchWriter) -> int:
+    '''Merges the publication's duplicate entity documents.
+    Returns the number of documents merged into a stable document.
+    '''
+    coll = client.collection(u'publications').document(pubname).collection(u'ent')
+    groups = defaultdict(list)
+    for doc in coll.stream():
+        groups[normalize_entity(doc.get('word'))].append(doc)
+
+    merged = 0
+    for word, docs in groups.items():
+        doc_id = entity_doc_id(word)
+        duplicates = [doc for doc in docs if doc.id != doc_id]
+        if not duplicates:
+            continue
+        writer.merge(coll.document(doc_id), word, duplicates)
+        merged += len(duplicates)
+
+    log.info(f'merged {merged} duplicate entity document(s) for {pubname}')
+    return merged
+
+
+def compact(client, pubnames: Iterable[str] = None, dry_run: bool = False) -> int:
+    '''Compacts the given publications, or all publications if none are given.
+    Returns the number of documents merged.
+    '''
+    if not pubnames:
+        pubnames = [doc.id for doc in client.collection(u'publications').stream()]
+
+    writer = BatchWriter(client, dry_run=dry_run)
+    merged = sum(compact_publication(client, pubname, writer) for pubname in pubnames)
+    writer.commit()
+    log.info(f'merged {merged} document(s) using {writer.writes} write(s)')
+    return merged
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--publication', help='publication to compact, defaults to all', action='append')  # noqa
+    parser.add_argument('--dry_run', help='report the number of merges without writing', action='store_true')  # noqa
+    args = parser.parse_args()
+
+    compact(get_database_client(), args.publication, args.dry_run)
+    exit(0)
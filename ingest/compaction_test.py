@@ -0,0 +1,86 @@
+import pytest
+from ingest.compaction import BatchWriter, compact
+from ingest.models import entity_doc_id
+from ingest.persistence_test import Client
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+NEW_YORK = entity_doc_id('new york')
+BOSTON = entity_doc_id('boston')
+
+documents = {
+    '/publications/pub0': {'count': 4},
+    '/publications/pub0/ent/old0': {'word': 'New York', 'count': 2},
+    '/publications/pub0/ent/old1': {'word': 'new york ', 'count': 3},
+    f'/publications/pub0/ent/{NEW_YORK}': {'word': 'new york', 'count': 5},
+    '/publications/pub0/ent/old2': {'word': 'Boston', 'count': 1},
+    '/publications/pub1': {'count': 1},
+    f'/publications/pub1/ent/{BOSTON}': {'word': 'boston', 'count': 1},
+}
+
+
+@pytest.fixture(scope='function')
+def client():
+    return Client(documents)
+
+
+def test_compact(client):
+    assert compact(client) == 3
+    assert client.docs == {
+        '/publications/pub0': {'count': 4},
+        f'/publications/pub0/ent/{NEW_YORK}': {'word': 'new york', 'count': 10},
+        f'/publications/pub0/ent/{BOSTON}': {'word': 'boston', 'count': 1},
+        '/publications/pub1': {'count': 1},
+        f'/publications/pub1/ent/{BOSTON}': {'word': 'boston', 'count': 1},
+    }
+
+
+def test_compact_publication(client):
+    assert compact(client, ['pub1']) == 0
+    assert client.commits == []
+    assert client.docs == documents
+
+
+def test_compact_dry_run(client):
+    assert compact(client, dry_run=True) == 3
+    assert client.commits == []
+    assert client.docs == documents
+
+
+def test_batch_writer_keeps_merges_together(client):
+    writer = BatchWriter(client, max_writes=6)
+    docs = client.collection('publications').document('pub0').collection('ent').stream()
+    new_york = [doc for doc in docs if doc.get('word').strip().lower() == 'new york' and doc.id != NEW_YORK]
+    ref = client.collection('publications').document('pub0').collection('ent').document(NEW_YORK)
+
+    # The increment counts as 2 writes, so the second merge doesn't fit in the first batch.
+    writer.merge(ref, 'new york', new_york)
+    writer.merge(ref, 'new york', new_york[:1])
+    writer.commit()
+    assert [[op for op, _, _ in writes] for writes in client.commits] == [
+        ['set', 'delete', 'delete'],
+        ['set', 'delete'],
+    ]
+    assert writer.writes == 7
+
+
+def test_batch_writer_splits_large_merges(client):
+    writer = BatchWriter(client, max_writes=3)
+    docs = client.collection('publications').document('pub0').collection('ent').stream()
+    duplicates = [doc for doc in docs if doc.get('word').strip().lower() == 'new york' and doc.id != NEW_YORK]
+    ref = client.collection('publications').document('pub0').collection('ent').document(NEW_YORK)
+
+    writer.merge(ref, 'new york', duplicates)
+    writer.commit()
+    assert [[op for op, _, _ in writes] for writes in client.commits] == [['set', 'delete'], ['set', 'delete']]
+    assert client.docs[f'/publications/pub0/ent/{NEW_YORK}']['count'] == 10
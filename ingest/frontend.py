@@ -1,59 +1,174 @@
-from fastapi import Depends, FastAPI, HTTPException, Security, status
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from typing import Any, Dict, List, Set, Tuple
+
+from fastapi import Depends, FastAPI, HTTPException, Request, Security, status
 from fastapi.security import APIKeyHeader
+from pydantic import ValidationError
 
 from .debugging import app_logger as log
-from .messageq import QueueWrapper, create_queue_manager, register_manager
+from .messageq import create_queue_manager, register_manager
 from .models import Post
+from .sharding import HashRing, Node, parse_nodes
 
 # Use an access token to secure the post/enqueue uri
 API_KEY_HEADER = APIKeyHeader(name='access_token', auto_error=False)
+# The number of seconds clients are asked to wait when the input queue is full.
+RETRY_AFTER = 5
+# A comma separated list of the host:port of each backend node's input queue.
+# When set, posts are sharded across the nodes by publication.
+INGEST_NODES = os.environ.get('ingest_nodes')
 app = FastAPI()
 
 
-class Connector:
-    '''Connector is used to manage the connection to the input Queue.
-    The queue manager requires a call to .connect() to establish a connection.
-    By reusing connections we can better manage our networking resources.
-
-    This code is ugly and I don't want to maintain it. However, I couldn't 
-    find a simple way to check to see if the connection is established or not.
+class AsyncConnector:
+    '''AsyncConnector is an asyncio friendly client for the input Queue.
 
-    I'd like to be able to do something like: 
+    The queue manager's proxies make blocking socket calls, so they're called
+    from a small pool of threads, keeping them off of the event loop.
+    Each thread holds its own connection, which is re-established if the
+    connection is lost, for example because the backend restarted.
 
-    if self.manager.closed:
-        self.manager.connect()
+    Calls to put are pipelined. Once every thread is waiting on the backend,
+    new posts are held until a thread is free, and then sent together with a
+    single call to try_put_upto. Posts are accepted in order until the queue
+    is full, so each post in the batch gets its own result.
 
-    however, I didn't see a public property or method that made this possible. 
-    For now, this will have to do. However, remove as soon as a simple way to
-    solve this is found.
+    Instances are used as FastAPI dependencies: Depends(AsyncConnector())
     '''
 
-    def __init__(self):
+    def __init__(self, port: int = 50000, pool_size: int = 4, max_pipeline: int = 1_000, host: str = '127.0.0.1'):
         register_manager('iqueue')
-        self.manager = create_queue_manager(50000)
-        self.iqueue = None
+        self._host: str = host
+        self._port: int = port
+        self._pool_size: int = pool_size
+        self._max_pipeline: int = max_pipeline
+        self._executor = ThreadPoolExecutor(pool_size, thread_name_prefix='iqueue')
+        self._local = threading.local()
+        self._pending: List[Tuple[object, asyncio.Future]] = []
+        self._in_flight: int = 0
+        # Holds references to the send tasks, so they aren't garbage collected while running.
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def __call__(self):
+        return self
+
+    def _queue(self):
+        '''returns the calling thread's connected input queue proxy. '''
+        iqueue = getattr(self._local, 'iqueue', None)
+        if iqueue is None:
+            manager = create_queue_manager(self._port, self._host)
+            manager.connect()
+            iqueue = self._local.iqueue = manager.iqueue()
+        return iqueue
+
+    def _call(self, method: str, *args) -> Any:
+        '''Calls the method on the input queue, reconnecting once if the connection was lost.'''
+        try:
+            return getattr(self._queue(), method)(*args)
+        except (ConnectionError, EOFError) as ex:
+            log.info('input queue connection lost, reconnecting')
+            self._local.iqueue = None
+            return getattr(self._queue(), method)(*args)
 
-    def __call__(self):
-        '''returns a connected input queue manager or raises an error. '''
-        if self.iqueue:
-            return self.iqueue
+    async def call(self, method: str, *args) -> Any:
+        '''Calls the method on the input queue from the thread pool.'''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, method, *args)
 
+    async def put(self, obj: object) -> bool:
+        '''Returns True if the object was put on the input queue.'''
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((obj, fut))
+        self._send_pending()
+        return await fut
+
+    async def put_many(self, objs: List[object]) -> List[bool]:
+        '''Puts all or none of the objects on the input queue.
+        Returns whether each object was put on the queue.
+        '''
+        return [await self.call('try_put_many', objs)] * len(objs)
+
+    async def depth(self) -> int:
+        return await self.call('depth')
+
+    def _send_pending(self):
+        while self._pending and self._in_flight < self._pool_size:
+            batch = self._pending[:self._max_pipeline]
+            self._pending = self._pending[self._max_pipeline:]
+            self._in_flight += 1
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[object, asyncio.Future]]):
         try:
-            self.iqueue = self.manager.iqueue()
-            return self.iqueue
-        except AssertionError as ae:
-            if ae.args == ('server not yet started',):
-                try:
-                    self.manager.connect()
-                except ConnectionRefusedError:
-                    raise
+            accepted = await self.call('try_put_upto', [obj for obj, _ in batch])
+            for index, (_, fut) in enumerate(batch):
+                if not fut.done():
+                    fut.set_result(index < accepted)
+        except Exception as ex:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(ex)
+        finally:
+            self._in_flight -= 1
+            self._send_pending()
+
 
-                return self()
-        except:
-            raise
+class ShardedConnector:
+    '''ShardedConnector routes each post to one of several backend nodes,
+    using consistent hashing on the post's publication. All of a publication's
+    posts are aggregated by the same node, so its counts are only written by
+    that node's savers.
 
+    Instances are used as FastAPI dependencies in place of an AsyncConnector.
+    '''
 
-iqueue = Connector()
+    def __init__(self, nodes: List[Node], **connector_options):
+        self.ring = HashRing(nodes)
+        self.connectors: Dict[Node, AsyncConnector] = {
+            node: AsyncConnector(port=node[1], host=node[0], **connector_options) for node in nodes
+        }
+
+    async def __call__(self):
+        return self
+
+    def connector(self, post: Dict) -> AsyncConnector:
+        # Keyed the same as ProcessedPost.pub_key, which the workers aggregate by.
+        return self.connectors[self.ring.node(post['publication'].strip().lower())]
+
+    async def put(self, post: Dict) -> bool:
+        '''Returns True if the post was put on its node's input queue.'''
+        return await self.connector(post).put(post)
+
+    async def put_many(self, posts: List[Dict]) -> List[bool]:
+        '''Puts each node's posts on its input queue concurrently.
+        Each node accepts all or none of its posts, but some nodes may accept
+        their posts while others don't. Returns whether each post was put on a queue.
+        '''
+        shards = defaultdict(list)
+        for index, post in enumerate(posts):
+            shards[self.connector(post)].append(index)
+
+        accepted = [False] * len(posts)
+        shard_results = await asyncio.gather(*(
+            connector.put_many([posts[index] for index in indexes]) for connector, indexes in shards.items()
+        ))
+        for indexes, results in zip(shards.values(), shard_results):
+            for index, result in zip(indexes, results):
+                accepted[index] = result
+        return accepted
+
+    async def depth(self) -> int:
+        return sum(await asyncio.gather(*(connector.depth() for connector in self.connectors.values())))
+
+
+iqueue = ShardedConnector(parse_nodes(INGEST_NODES)) if INGEST_NODES else AsyncConnector()
 
 
 def check_auth_header(api_key_header: str = Security(API_KEY_HEADER)):
@@ -67,9 +182,87 @@ def check_auth_header(api_key_header: str = Security(API_KEY_HEADER)):
     )
 
 
+def queue_full():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="input queue is full",
+        headers={'Retry-After': str(RETRY_AFTER)},
+    )
+
+
 @app.post("/post/enqueue", status_code=status.HTTP_201_CREATED)
-def create_post(post: Post, queue: QueueWrapper = Depends(iqueue), authenticated: bool = Depends(check_auth_header)):
+async def create_post(post: Post, queue: AsyncConnector = Depends(iqueue), authenticated: bool = Depends(check_auth_header)):
+    try:
+        # Plain dicts can be encoded by every codec the backend queue may use.
+        accepted = await queue.put(post.dict())
+    except Exception as ex:
+        raise HTTPException(status_code=500)
+
+    # Rather than blocking or buffering, ask the client to retry later.
+    if not accepted:
+        raise queue_full()
+
+
+def parse_posts(body: bytes, content_type: str) -> List[Any]:
+    '''Parses the body of a batch request into a list of unvalidated posts.
+    The body is either a JSON array, or NDJSON with one post per line.
+    Raises a ValueError if the body can't be parsed.
+    '''
+    if content_type.startswith('application/x-ndjson'):
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+    items = json.loads(body)
+    if not isinstance(items, list):
+        raise ValueError('expected a JSON array')
+    return items
+
+
+@app.post("/post/enqueue_batch", status_code=status.HTTP_201_CREATED)
+async def create_posts(request: Request, queue: AsyncConnector = Depends(iqueue), authenticated: bool = Depends(check_auth_header)):
+    '''Enqueues a JSON array or NDJSON stream of posts with a single call to the queue manager.
+    Posts that fail validation are skipped and returned as errors, along with their index.
+    If every post fails validation nothing is enqueued, and the errors are returned with a 422.
+    When sharded, posts rejected by a full node's queue are also returned as errors.
+    '''
+    try:
+        items = parse_posts(await request.body(), request.headers.get('content-type', ''))
+    except ValueError as ex:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="body must be a JSON array or NDJSON",
+        )
+
+    posts, indexes, errors = [], [], []
+    for index, item in enumerate(items):
+        try:
+            posts.append(Post.parse_obj(item).dict())
+            indexes.append(index)
+        except ValidationError as ve:
+            errors.append({'index': index, 'errors': ve.errors()})
+
+    if errors and not posts:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=errors)
+
+    if posts:
+        try:
+            accepted = await queue.put_many(posts)
+        except Exception as ex:
+            raise HTTPException(status_code=500)
+
+        if not any(accepted):
+            raise queue_full()
+
+        full = [{'loc': [], 'msg': 'input queue is full', 'type': 'queue.full'}]
+        errors.extend({'index': index, 'errors': full} for index, ok in zip(indexes, accepted) if not ok)
+        errors.sort(key=lambda error: error['index'])
+        posts = [post for post, ok in zip(posts, accepted) if ok]
+
+    return {'enqueued': len(posts), 'errors': errors}
+
+
+@app.get("/queue/depth")
+async def queue_depth(queue: AsyncConnector = Depends(iqueue), authenticated: bool = Depends(check_auth_header)):
     try:
-        queue.put(post)
+        return {'depth': await queue.depth()}
     except Exception as ex:
         raise HTTPException(status_code=500)
@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from ingest.frontend import ShardedConnector, app, parse_posts
+from ingest.messageq import QueueWrapper, create_queue_manager, register_manager
+
+posts = [{'content': 'text0', 'publication': 'pub0'}, {'content': 'text1', 'publication': 'pub1'}]
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+def test_parse_posts_array():
+    assert parse_posts(json.dumps(posts).encode(), 'application/json') == posts
+
+
+def test_parse_posts_ndjson():
+    body = '\n'.join(json.dumps(post) for post in posts) + '\n\n'
+    assert parse_posts(body.encode(), 'application/x-ndjson; charset=utf-8') == posts
+
+
+@pytest.mark.parametrize('body', [b'{"content": "text0"}', b'not json', b''])
+def test_parse_posts_invalid_body(body):
+    with pytest.raises(ValueError):
+        parse_posts(body, 'application/json')
+
+
+def test_parse_posts_doesnt_validate_items():
+    assert parse_posts(b'[1, {"content": "text0"}]', 'application/json') == [1, {'content': 'text0'}]
+
+
+def test_create_posts_all_invalid():
+    # Nothing is enqueued, so no connection to the backend is made.
+    response = TestClient(app).post(
+        '/post/enqueue_batch',
+        data=json.dumps([1, {'content': 'text0'}]),
+        headers={'access_token': 'ijdf8h74nj', 'content-type': 'application/json'},
+    )
+    assert response.status_code == 422
+    assert [error['index'] for error in response.json()['detail']] == [0, 1]
+
+
+def test_create_posts_invalid_body():
+    response = TestClient(app).post(
+        '/post/enqueue_batch',
+        data='{}',
+        headers={'access_token': 'ijdf8h74nj', 'content-type': 'application/json'},
+    )
+    assert response.status_code == 400
+
+
+@pytest.fixture(scope='function')
+def backends():
+    """Starts two backend input queue managers on localhost. The second queue holds up to 2 posts."""
+    queues = {('127.0.0.1', 50110): QueueWrapper('iqueue0'), ('127.0.0.1', 50111): QueueWrapper('iqueue1', maxsize=2)}
+    managers = []
+    for (host, port), queue in queues.items():
+        register_manager('iqueue', queue)
+        manager = create_queue_manager(port, host)
+        manager.start()
+        managers.append(manager)
+    yield queues
+    for manager in managers:
+        manager.shutdown()
+
+
+def drain(queue):
+    return [post['publication'] for post in queue.get_many(100, 0.2, wait=0.2)]
+
+
+def test_sharded_connector_routes_by_publication(backends):
+    connector = ShardedConnector(list(backends))
+    pubs = [f'pub{i}' for i in range(20)]
+    routed = {pub: connector.ring.node(pub) for pub in pubs}
+
+    async def put_posts():
+        return [await connector.put({'content': 'text', 'publication': f' {pub.upper()}'}) for pub in pubs[:2]]
+
+    asyncio.run(put_posts())
+    for node, queue in backends.items():
+        assert sorted(drain(queue)) == sorted(f' {pub.upper()}' for pub in pubs[:2] if routed[pub] == node)
+
+
+def test_sharded_connector_put_many_partial(backends):
+    connector = ShardedConnector(list(backends))
+    full_node = ('127.0.0.1', 50111)
+    pubs = [f'pub{i}' for i in range(20)]
+    posts = [{'content': 'text', 'publication': pub} for pub in pubs]
+    # The second node only has room for 2 posts, so none of its posts are accepted.
+    assert sum(connector.ring.node(pub) == full_node for pub in pubs) > 2
+
+    accepted = asyncio.run(connector.put_many(posts))
+    assert accepted == [connector.ring.node(pub) != full_node for pub in pubs]
+    assert sorted(drain(backends[('127.0.0.1', 50110)])) == sorted(pub for pub, ok in zip(pubs, accepted) if ok)
+    assert asyncio.run(connector.depth()) == 0
@@ -0,0 +1,67 @@
+###############################################################################
+'''
+    This module provides a fast rule-based alternative to the statistical
+    spacy model used to extract entities.
+
+    A gazetteer is a list of known entities. Texts are tokenized and matched
+    against the gazetteer with spacy's EntityRuler, which skips the
+    statistical model's processing entirely.
+
+    A gazetteer can be built from the entities already stored in Firestore:
+        buildgazetteer --top_n 500 --output /tmp/gazetteer.txt
+'''
+###############################################################################
+from typing import Iterable, List, Set
+
+import spacy
+from spacy.pipeline import EntityRuler
+
+from .debugging import app_logger as log
+
+# The label assigned to entities matched by the gazetteer.
+GAZETTEER_LABEL = 'GAZETTEER'
+
+
+def load_gazetteer(path: str) -> List[str]:
+    '''Returns the entities from a file containing one entity per line.'''
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def save_gazetteer(terms: Iterable[str], path: str):
+    with open(path, 'w') as f:
+        f.writelines(f'{term}\n' for term in sorted(terms))
+
+
+def gazetteer_from_firestore(client, top_n: int = 500) -> Set[str]:
+    '''Returns the set of the top_n entities of each stored publication.'''
+    terms = set()
+    for pub in client.collection(u'publications').stream():
+        q = pub.reference.collection(u'ent')
+        q = q.order_by('count', direction='DESCENDING').limit(top_n)
+        terms.update(doc.get('word') for doc in q.stream())
+    log.info(f'gazetteer contains {len(terms)} entities')
+    return terms
+
+
+def build_gazetteer_nlp(terms: Iterable[str]):
+    '''Returns a blank English pipeline that labels the given terms as entities.
+    Matching is case insensitive. Overlapping matches resolve to the longest one.
+    '''
+    nlp = spacy.blank('en')
+    ruler = EntityRuler(nlp, phrase_matcher_attr='LOWER')
+    ruler.add_patterns([{'label': GAZETTEER_LABEL, 'pattern': term} for term in terms])
+    nlp.add_pipe(ruler)
+    return nlp
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--top_n', help='number of entities taken from each publication', default=500, type=int)  # noqa
+    parser.add_argument('--output', help='path of the gazetteer file', default='/tmp/gazetteer.txt')  # noqa
+    args = parser.parse_args()
+
+    from .persistence import get_database_client
+    save_gazetteer(gazetteer_from_firestore(get_database_client(), args.top_n), args.output)
+    exit(0)
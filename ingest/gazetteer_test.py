@@ -0,0 +1,41 @@
+from ingest.gazetteer import GAZETTEER_LABEL, build_gazetteer_nlp, load_gazetteer, save_gazetteer
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+def test_save_load_gazetteer(tmp_path):
+    path = str(tmp_path / 'gazetteer.txt')
+    save_gazetteer({'new york', 'boston'}, path)
+    with open(path) as f:
+        assert f.read() == 'boston\nnew york\n'
+    assert load_gazetteer(path) == ['boston', 'new york']
+
+
+def test_load_gazetteer_skips_blank_lines(tmp_path):
+    path = tmp_path / 'gazetteer.txt'
+    path.write_text(' boston \n\n  \nnew york\n')
+    assert load_gazetteer(str(path)) == ['boston', 'new york']
+
+
+def test_build_gazetteer_nlp_case_insensitive():
+    nlp = build_gazetteer_nlp(['New York'])
+    doc = nlp('new york and NEW YORK and New Jersey')
+    assert [(ent.text, ent.label_) for ent in doc.ents] == [
+        ('new york', GAZETTEER_LABEL),
+        ('NEW YORK', GAZETTEER_LABEL),
+    ]
+
+
+def test_build_gazetteer_nlp_longest_match():
+    nlp = build_gazetteer_nlp(['New York', 'New York Times'])
+    doc = nlp('The New York Times is in New York.')
+    assert [ent.text for ent in doc.ents] == ['New York Times', 'New York']
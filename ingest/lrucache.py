@@ -0,0 +1,74 @@
+###############################################################################
+'''
+    This module provides a least recently used cache bounded by the
+    estimated number of bytes used by its keys and values.
+
+'''
+###############################################################################
+import sys
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUCache(object):
+    '''LRUCache evicts the least recently used values once the estimated size
+    of the cached keys and values exceeds max_bytes.
+    The size of each value is estimated using the sizeof callable.
+    '''
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int] = sys.getsizeof):
+        self._max_bytes: int = max_bytes
+        self._sizeof = sizeof
+        self._data: OrderedDict = OrderedDict()
+        self._bytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    @property
+    def bytes(self) -> int:
+        '''Read-only property with the estimated size of the cache in bytes.'''
+        return self._bytes
+
+    @property
+    def hit_rate(self) -> float:
+        '''Read-only property with the ratio of calls to get that found a value.'''
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        '''Removes every cached value. The hit and miss counts are kept.'''
+        self._data.clear()
+        self._bytes = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        '''Returns the cached value, marking it as the most recently used.'''
+        try:
+            value, _ = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        '''Caches the value, evicting least recently used values as needed.
+        Values larger than the cache itself aren't cached.
+        '''
+        size = sys.getsizeof(key) + self._sizeof(value)
+        if size > self._max_bytes:
+            return
+        if key in self._data:
+            self._bytes -= self._data.pop(key)[1]
+
+        self._data[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self._max_bytes:
+            _, (_, evicted) = self._data.popitem(last=False)
+            self._bytes -= evicted
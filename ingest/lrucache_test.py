@@ -0,0 +1,57 @@
+import pytest
+from ingest.lrucache import LRUCache
+
+
+def sizeof(value):
+    return 100
+
+
+@pytest.fixture(scope='function')
+def cache():
+    return LRUCache(max_bytes=250, sizeof=sizeof)
+
+
+def test_get_put(cache):
+    assert cache.get('key0') is None
+    cache.put('key0', 'value0')
+    assert cache.get('key0') == 'value0'
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert cache.hit_rate == 0.5
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(max_bytes=300, sizeof=sizeof)
+    cache.put(0, 'value0')
+    cache.put(1, 'value1')
+    cache.get(0)
+    # The integer keys are 28 bytes, so the third value exceeds max_bytes.
+    cache.put(2, 'value2')
+    assert 0 in cache
+    assert 1 not in cache
+    assert 2 in cache
+    assert cache.bytes <= 300
+
+
+def test_put_replaces_value(cache):
+    cache.put(0, 'value0')
+    cache.put(0, 'value1')
+    assert len(cache) == 1
+    assert cache.get(0) == 'value1'
+
+
+def test_put_ignores_values_larger_than_cache():
+    cache = LRUCache(max_bytes=50, sizeof=sizeof)
+    cache.put(0, 'value0')
+    assert len(cache) == 0
+    assert cache.bytes == 0
+
+
+def test_clear(cache):
+    cache.put('key0', 'value0')
+    cache.get('key0')
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.bytes == 0
+    assert cache.get('key0') is None
+    assert cache.hits == 1
@@ -4,43 +4,261 @@
 
 '''
 ###############################################################################
-from multiprocessing import Event, Queue
+import time
+from itertools import islice
+from multiprocessing import Event, Queue, Value
 from multiprocessing.managers import BaseManager
 from queue import Empty
-from typing import Any, List
+from typing import Any, Iterable, List, Union
 
 from .debugging import app_logger as log
+from .spool import Spool, Spooled
+from .wire import get_codec
 
 
 class QueueWrapper(object):
+    '''QueueWrapper wraps a multiprocessing.Queue to make it drainable.
 
-    def __init__(self, name: str, q: Queue = None, prevent_writes: Event = None):
+    Producers outside of the backend should use try_put, which enforces the
+    optional maxsize and high/low watermark backpressure. Once the depth of
+    the queue reaches the high watermark, try_put rejects messages until the
+    depth drops to the low watermark.
+
+    The size limits aren't enforced by the underlying queue. That ensures the
+    sentinal STOP can always be put on the queue, even when it's full.
+
+    If a codec name is given, messages are encoded with that codec before
+    they're put on the queue, and decoded when they're taken off of it.
+    See the wire module for the available codecs.
+
+    If a spool is given, messages are written through to it before they're
+    put on the queue, so they survive a crash. Consumers call ack once the
+    messages they got are no longer needed, and replay puts the messages
+    that were never acknowledged back on the queue after a restart.
+    See the spool module.
+    '''
+
+    def __init__(self, name: str, q: Queue = None, prevent_writes: Event = None,
+                 maxsize: int = 0, high_watermark: int = 0, low_watermark: int = 0, codec: str = None,
+                 spool: Spool = None):
         self.name: str = name
         self.q: Queue = q or Queue()
         self._prevent_writes: Event = prevent_writes or Event()
+        # Zero values disable the size limit and backpressure.
+        self._maxsize: int = maxsize
+        self._high_watermark: int = high_watermark
+        self._low_watermark: int = low_watermark
+        self._throttled: Event = Event()
+        self._codec = get_codec(codec) if codec else None
+        # Set when get_batch receives STOP while it's already holding items.
+        self._stop_pending: bool = False
+        # The number of messages taken off the queue by every process sharing it.
+        self._consumed = Value('Q', 0)
+        self._spool: Spool = spool
+        # The offsets of the spooled messages this process got, that it hasn't acknowledged.
+        self._unacked: List[int] = []
 
-    def get(self) -> Any:
+    def get(self, timeout: float = None) -> Any:
         '''This call blocks until a it gets a message from the queue.
         If the queue is drained, it returns the sentinal string STOP.
         If the queue is closed while this call is blocking, it'll return STOP
+        If a timeout is given and no message arrives in time, queue.Empty is raised.
         '''
         if self.is_drained:
             return 'STOP'
+        return self._get(timeout)
+
+    def _get(self, timeout: float = None) -> Any:
         try:
-            return self.q.get()
+            msg = self.q.get(timeout=timeout)
+        except Empty:
+            raise
         except Exception as ex:
             log.info(f'q.get() interupted')
             return 'STOP'
+        with self._consumed.get_lock():
+            self._consumed.value += 1
+        return self._decode(msg)
+
+    def get_many(self, max_items: int, timeout: float, wait: float = None) -> List[Any]:
+        '''Blocks until it gets a message from the queue, then keeps pulling
+        messages until max_items are collected or timeout seconds have passed.
+        If the sentinal string STOP is received it's returned as the last item.
+        If wait is given and no message arrives within wait seconds, an empty list is returned.
+        '''
+        try:
+            msgs = [self.get(wait)]
+        except Empty:
+            return []
+        deadline = time.monotonic() + timeout
+        while len(msgs) < max_items and msgs[-1] != 'STOP':
+            try:
+                msgs.append(self._get(max(deadline - time.monotonic(), 0)))
+            except Empty:
+                break
+        return msgs
 
     def put(self, obj: object):
         if self.is_writable:
             log.debug('putting message on the queue')
-            self.q.put(obj)
+            self.q.put(self._encode(obj))
+
+    def try_put(self, obj: object) -> bool:
+        '''Puts the object on the queue if it's writable and accepting messages.
+        Returns True if the object was put on the queue.
+        '''
+        if not (self.is_writable and self.accepting()):
+            return False
+        log.debug('putting message on the queue')
+        self.q.put(self._encode(obj))
+        return True
+
+    def try_put_many(self, objs: List[object]) -> bool:
+        '''Puts all of the objects on the queue if it's writable and has room for them.
+        Either all or none of the objects are put on the queue.
+        Returns True if the objects were put on the queue.
+        '''
+        if not (self.is_writable and self.accepting()):
+            return False
+        if self._maxsize and self.depth() + len(objs) > self._maxsize:
+            return False
+        self.put_many(objs)
+        return True
+
+    def try_put_upto(self, objs: List[object]) -> int:
+        '''Puts as many of the objects on the queue, in order, as it has room for.
+        Returns the number of objects put on the queue.
+        '''
+        if not (self.is_writable and self.accepting()):
+            return 0
+        count = len(objs)
+        if self._maxsize:
+            count = max(min(count, self._maxsize - self.depth()), 0)
+        self.put_many(objs[:count])
+        return count
+
+    def accepting(self) -> bool:
+        '''Returns False if the queue is full, or throttled by backpressure.
+        This is a method rather than a property so that it's exposed to the
+        proxies created by the QueueManager.
+        '''
+        depth = self.depth()
+        if self._throttled.is_set():
+            if depth <= self._low_watermark:
+                log.info(f'{self.name} queue depth {depth} at low watermark, accepting messages')
+                self._throttled.clear()
+        elif self._high_watermark and depth >= self._high_watermark:
+            log.info(f'{self.name} queue depth {depth} at high watermark, rejecting messages')
+            self._throttled.set()
+
+        if self._throttled.is_set():
+            return False
+        return not (self._maxsize and depth >= self._maxsize)
+
+    def depth(self) -> int:
+        '''Returns the approximate number of messages on the queue.'''
+        return self.q.qsize()
+
+    def consumed(self) -> int:
+        '''Returns the number of messages taken off the queue, by any process.'''
+        return self._consumed.value
 
     def put_many(self, objs: List[object]):
         for obj in objs:
             self.put(obj)
 
+    def put_batch(self, objs: Iterable[object], chunk_size: int = None):
+        '''Puts all of the given objects on the queue as a single list.
+        A list is pickled and sent through the underlying pipe once, which is
+        far cheaper than sending each object individually.
+        If a chunk_size is given, the objects are consumed lazily and put on
+        the queue as lists of up to chunk_size objects.
+        Use get_batch to consume the objects.
+        '''
+        if not self.is_writable:
+            return
+        if chunk_size is None:
+            log.debug('putting batch on the queue')
+            self.q.put(self._encode(list(objs)))
+            return
+
+        objs = iter(objs)
+        for chunk in iter(lambda: list(islice(objs, chunk_size)), []):
+            log.debug('putting batch on the queue')
+            self.q.put(self._encode(chunk))
+
+    def get_batch(self, max_items: int = 10_000, timeout: float = 0.0, wait: float = None) -> Union[List[Any], str]:
+        '''This call blocks until it gets a batch put by put_batch from the queue.
+        Further batches are added to the result until it holds at least max_items,
+        or timeout seconds have passed. Messages put with put are included as items.
+        If the queue is drained, or STOP is received, it returns the sentinal string STOP.
+        Items received ahead of STOP are returned first, and STOP on the next call.
+        If wait is given and no batch arrives within wait seconds, an empty list is returned.
+        '''
+        if self._stop_pending:
+            return 'STOP'
+
+        items = []
+        try:
+            msg = self.get(wait)
+        except Empty:
+            return items
+        deadline = time.monotonic() + timeout
+        while True:
+            if msg == 'STOP':
+                self._stop_pending = bool(items)
+                return items or 'STOP'
+
+            if isinstance(msg, list):
+                items.extend(msg)
+            else:
+                items.append(msg)
+
+            if len(items) >= max_items:
+                return items
+            try:
+                msg = self._get(max(deadline - time.monotonic(), 0))
+            except Empty:
+                return items
+
+    def ack(self, num: int = None):
+        '''Acknowledges the first num spooled messages this process got from the
+        queue, and hasn't acknowledged yet. By default every message is acknowledged.
+        '''
+        if self._spool is None:
+            return
+        offsets = self._unacked[:num]
+        if offsets:
+            self._spool.ack(offsets)
+            del self._unacked[:len(offsets)]
+
+    def replay(self) -> int:
+        '''Puts the spooled messages that were never acknowledged back on the queue.
+        Returns the number of messages.
+        '''
+        if self._spool is None:
+            return 0
+        count = 0
+        for offset, msg in self._spool.recover():
+            self.q.put(Spooled(offset, msg))
+            count += 1
+        return count
+
+    def _encode(self, obj: object) -> object:
+        msg = obj if self._codec is None else self._codec.encode(obj)
+        if self._spool is None:
+            return msg
+        return Spooled(self._spool.append(msg), msg)
+
+    def _decode(self, msg: object) -> object:
+        if isinstance(msg, Spooled):
+            self._unacked.append(msg.offset)
+            msg = msg.payload
+        # Messages put directly on the underlying queue, such as STOP, aren't encoded.
+        if self._codec is None or not isinstance(msg, bytes):
+            return msg
+        return self._codec.decode(msg)
+
     def prevent_writes(self):
         '''Prevent external writes to the queue. 
         This is useful for shutting down, or dealing with back pressure.
@@ -75,8 +293,8 @@ def register_manager(name: str, queue: QueueWrapper = None):
         QueueManager.register(name)
 
 
-def create_queue_manager(port: int) -> QueueManager:
-    '''Binds to 127.0.0.1 on the given port. 
+def create_queue_manager(port: int, host: str = '127.0.0.1') -> QueueManager:
+    '''Binds to 127.0.0.1 on the given port, unless another host is given.
     Using localhost on at least Debian systems results in extremly slow put() calls.
     '''
-    return QueueManager(address=('127.0.0.1', port), authkey=b'ingestbackend')
+    return QueueManager(address=(host, port), authkey=b'ingestbackend')
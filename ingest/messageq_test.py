@@ -1,5 +1,5 @@
 import pytest
-from queue import Queue
+from queue import Empty, Queue
 from ingest.messageq import QueueWrapper
 from unittest.mock import MagicMock
 
@@ -47,3 +47,144 @@ def test_draining(queue_wrapper):
     queue_wrapper.prevent_writes()
     assert not queue_wrapper.is_writable
     assert queue_wrapper.is_drained
+
+
+def test_get_many(queue_wrapper):
+    queue_wrapper.put_many(['message1', 'message2', 'message3'])
+    assert queue_wrapper.get_many(2, 0.1) == ['message1', 'message2']
+    assert queue_wrapper.get_many(2, 0.1) == ['message3']
+    assert queue_wrapper.empty
+
+
+def test_get_many_stops_at_sentinel(queue_wrapper):
+    queue_wrapper.put_many(['message1', 'STOP', 'message2'])
+    assert queue_wrapper.get_many(5, 0.1) == ['message1', 'STOP']
+    assert queue_wrapper.get_many(5, 0.1) == ['message2']
+
+
+def test_get_many_drained_returns_stop(queue_wrapper):
+    queue_wrapper.prevent_writes()
+    assert queue_wrapper.get_many(5, 0.1) == ['STOP']
+
+
+def test_put_batch_sends_one_message(queue_wrapper):
+    queue_wrapper.put_batch(('message1', 'message2'))
+    assert queue_wrapper.q.qsize() == 1
+    assert queue_wrapper.get_batch() == ['message1', 'message2']
+    assert queue_wrapper.empty
+
+
+def test_get_batch_merges_batches(queue_wrapper):
+    queue_wrapper.put_batch(['message1', 'message2'])
+    queue_wrapper.put('message3')
+    queue_wrapper.put_batch(['message4'])
+    assert queue_wrapper.get_batch(max_items=3) == ['message1', 'message2', 'message3']
+    assert queue_wrapper.get_batch(max_items=3) == ['message4']
+
+
+def test_get_batch_returns_stop_after_items(queue_wrapper):
+    queue_wrapper.put_batch(['message1'])
+    queue_wrapper.put('STOP')
+    assert queue_wrapper.get_batch() == ['message1']
+    assert queue_wrapper.get_batch() == 'STOP'
+
+
+def test_get_batch_drained_returns_stop(queue_wrapper):
+    queue_wrapper.prevent_writes()
+    assert queue_wrapper.get_batch() == 'STOP'
+
+
+def test_put_batch_prevented_writes(queue_wrapper):
+    queue_wrapper.prevent_writes()
+    queue_wrapper.put_batch(['message1'])
+    assert queue_wrapper.empty
+
+
+def test_get_timeout(queue_wrapper):
+    with pytest.raises(Empty):
+        queue_wrapper.get(timeout=0.01)
+
+
+def test_get_batch_wait(queue_wrapper):
+    assert queue_wrapper.get_batch(wait=0.01) == []
+
+
+def test_try_put_maxsize():
+    queue_wrapper = QueueWrapper('testq', q=Queue(), maxsize=2)
+    assert queue_wrapper.try_put('message1')
+    assert queue_wrapper.try_put('message2')
+    assert not queue_wrapper.try_put('message3')
+    assert queue_wrapper.depth() == 2
+    queue_wrapper.get()
+    assert queue_wrapper.try_put('message3')
+
+
+def test_try_put_watermarks():
+    queue_wrapper = QueueWrapper('testq', q=Queue(), high_watermark=3, low_watermark=1)
+    for i in range(3):
+        assert queue_wrapper.try_put(f'message{i}')
+    assert not queue_wrapper.try_put('message3')
+    # Still throttled until the depth drops to the low watermark.
+    queue_wrapper.get()
+    assert not queue_wrapper.try_put('message3')
+    queue_wrapper.get()
+    assert queue_wrapper.try_put('message3')
+
+
+def test_try_put_prevented_writes(queue_wrapper):
+    queue_wrapper.prevent_writes()
+    assert not queue_wrapper.try_put('message')
+    assert queue_wrapper.empty
+
+
+def test_try_put_many_all_or_nothing():
+    queue_wrapper = QueueWrapper('testq', q=Queue(), maxsize=3)
+    assert queue_wrapper.try_put_many(['message1', 'message2'])
+    assert not queue_wrapper.try_put_many(['message3', 'message4'])
+    assert queue_wrapper.depth() == 2
+    assert queue_wrapper.try_put_many(['message3'])
+    assert queue_wrapper.depth() == 3
+
+
+def test_try_put_upto_partial():
+    queue_wrapper = QueueWrapper('testq', q=Queue(), maxsize=3)
+    assert queue_wrapper.try_put_upto(['message1', 'message2']) == 2
+    assert queue_wrapper.try_put_upto(['message3', 'message4']) == 1
+    assert queue_wrapper.try_put_upto(['message5']) == 0
+    assert queue_wrapper.get_many(5, 0.1) == ['message1', 'message2', 'message3']
+
+
+def test_consumed(queue_wrapper):
+    queue_wrapper.put_many(['message1', 'message2'])
+    queue_wrapper.put_batch(['message3', 'message4'])
+    assert queue_wrapper.consumed() == 0
+    queue_wrapper.get()
+    queue_wrapper.get_batch()
+    assert queue_wrapper.consumed() == 3
+
+
+def test_get_many_wait(queue_wrapper):
+    assert queue_wrapper.get_many(5, 0.1, wait=0.01) == []
+
+
+def test_put_batch_chunks(queue_wrapper):
+    queue_wrapper.put_batch((f'message{i}' for i in range(5)), chunk_size=2)
+    assert queue_wrapper.q.qsize() == 3
+    assert queue_wrapper.get_batch(max_items=1) == ['message0', 'message1']
+    assert queue_wrapper.get_batch() == ['message2', 'message3', 'message4']
+
+
+@pytest.mark.parametrize('codec', ['marshal'])
+def test_codec_round_trip(codec):
+    queue_wrapper = QueueWrapper('testq', q=Queue(), codec=codec)
+    queue_wrapper.put({'content': 'content', 'publication': 'pub0'})
+    queue_wrapper.put_batch([('pub0', 'ent', 'id0', {'word': 'ent0', 'count': 1})])
+    queue_wrapper.q.put('STOP')
+    assert isinstance(queue_wrapper.q.get(), bytes)
+    assert queue_wrapper.get_batch() == [('pub0', 'ent', 'id0', {'word': 'ent0', 'count': 1})]
+    assert queue_wrapper.get_batch() == 'STOP'
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        QueueWrapper('testq', q=Queue(), codec='unknown')
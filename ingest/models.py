@@ -5,12 +5,29 @@
 
 '''
 ###############################################################################
+import hashlib
+import heapq
+import sys
 from collections import Counter
-from typing import Any, Dict, List, Tuple
+from operator import itemgetter
+from typing import Any, Dict, Iterator, List, Tuple
 
 from pydantic import BaseModel
 
 
+def normalize_entity(word: str) -> str:
+    '''Returns the form of the entity that's stored, and used for its document id.'''
+    return word.strip().lower()
+
+
+def entity_doc_id(word: str) -> str:
+    '''Returns the Firestore document id used for the given normalized entity.
+    The id is a 64-bit blake2b digest of the entity, so unlike hash()
+    it's the same in every process, regardless of PYTHONHASHSEED.
+    '''
+    return hashlib.blake2b(word.encode(), digest_size=8).hexdigest()
+
+
 class Post(BaseModel):
     '''Post is used to store content and publication from the front-end.
     '''
@@ -18,8 +35,48 @@ class Post(BaseModel):
     publication: str  # Required
 
 
+class EntityVocab(object):
+    '''EntityVocab interns entity strings as integer ids.
+    Counting ids rather than strings keeps the aggregation cache compact,
+    and each entity string is stored once per process.
+    The vocab only grows, so its estimated size is tracked to allow it to be bounded.
+    '''
+
+    # A rough estimate of the bytes used by each entry besides the word itself:
+    # the dict's hash table entry, the list slot, and the id.
+    ENTRY_BYTES = 100
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._words: List[str] = []
+        self._bytes: int = 0
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+    def __getitem__(self, entity_id: int) -> str:
+        return self._words[entity_id]
+
+    @property
+    def bytes(self) -> int:
+        '''Read-only property with the estimated size of the vocab in bytes.'''
+        return self._bytes
+
+    def intern(self, word: str) -> int:
+        '''Returns the id for the given word, assigning one if needed.'''
+        entity_id = self._ids.get(word)
+        if entity_id is None:
+            entity_id = self._ids[word] = len(self._words)
+            self._words.append(word)
+            self._bytes += sys.getsizeof(word) + self.ENTRY_BYTES
+        return entity_id
+
+
 class ProcessedPost(BaseModel):
     '''ProcessedPost is to store the results of the DataProcessor.
+    The entities Counter is keyed by either the entity strings, or
+    their ids in an EntityVocab. Entities are normalized with
+    normalize_entity before they're counted.
     '''
     publication: str = None  # Not-required on creation.
     entities: Counter = Counter()
@@ -29,15 +86,23 @@ class ProcessedPost(BaseModel):
     def pub_key(self):
         return self.publication.strip().lower()
 
-    def _transform_for_database(self, top_n: int) -> Tuple[str, str, str, Dict]:
+    def stream_for_database(self, top_n: int = 2000, vocab: EntityVocab = None) -> Iterator[Tuple[str, str, str, Dict]]:
+        '''Lazily yields the same messages as transform_for_database.
+        Only the top n (entity, count) pairs are held by the heap used to select them,
+        each message is created as it's consumed.
+        '''
         # Return the top n entities
-        for word, count in self.entities.most_common(top_n):
-            yield self.pub_key, 'ent', str(hash(word)), {'word': word, 'count': count}
+        for word, count in heapq.nlargest(top_n, self.entities.items(), key=itemgetter(1)):
+            # Materialize the entity string if the entities are counted by id.
+            if vocab is not None:
+                word = vocab[word]
+            yield self.pub_key, 'ent', entity_doc_id(word), {'word': word, 'count': count}
         # Return the total count for the publication
         yield self.pub_key, None, None, {'count': self.article_count}
 
-    def transform_for_database(self, top_n=2000) -> List[Tuple[str, str, str, Dict]]:
+    def transform_for_database(self, top_n=2000, vocab: EntityVocab = None) -> List[Tuple[str, str, str, Dict]]:
         '''Returns a list of tuples containing one of two types of message.
+        If the entities are counted by id, the vocab is used to look up the entity strings.
 
         For messages used as Firestore documents storing the word and count:
             (publication, collection, doc_id, document_dict)
@@ -46,10 +111,12 @@ class ProcessedPost(BaseModel):
             publication, None, None, {'count': 1}
             When consuming this type of message check the collection or doc_id for None values
         '''
-        return list(self._transform_for_database(top_n))
+        return list(self.stream_for_database(top_n, vocab))
 
     def __add__(self, other):
         self.article_count += 1
         self.publication = other.publication
-        self.entities += other.entities
+        # Both += and update merge in place, but += then scans the whole
+        # Counter to drop non-positive counts, which update skips.
+        self.entities.update(other.entities)
         return self
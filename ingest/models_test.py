@@ -0,0 +1,84 @@
+import pytest
+from collections import Counter
+from ingest.models import EntityVocab, ProcessedPost, entity_doc_id, normalize_entity
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+@pytest.fixture(scope='function')
+def vocab():
+    return EntityVocab()
+
+
+def test_vocab_intern(vocab):
+    assert vocab.intern('ent0') == 0
+    assert vocab.intern('ent1') == 1
+    assert vocab.intern('ent0') == 0
+    assert len(vocab) == 2
+    assert vocab[1] == 'ent1'
+
+
+def test_vocab_bytes(vocab):
+    assert vocab.bytes == 0
+    vocab.intern('ent0')
+    size = vocab.bytes
+    assert size > EntityVocab.ENTRY_BYTES
+    vocab.intern('ent0')
+    assert vocab.bytes == size
+    vocab.intern('ent1')
+    assert vocab.bytes == 2 * size
+
+
+def test_processed_post_add_merges_in_place(vocab):
+    ids = [vocab.intern(f'ent{i}') for i in range(3)]
+    cached = ProcessedPost()
+    entities = cached.entities
+    cached += ProcessedPost(publication='Pub0', entities=Counter(ids[:2]))
+    cached += ProcessedPost(publication='Pub0', entities=Counter(ids[1:]))
+    assert cached.entities is entities
+    assert cached.entities == Counter({ids[0]: 1, ids[1]: 2, ids[2]: 1})
+    assert cached.article_count == 2
+    assert cached.pub_key == 'pub0'
+
+
+def test_transform_for_database_with_vocab(vocab):
+    ids = [vocab.intern(f'ent{i}') for i in range(3)]
+    post = ProcessedPost(publication='pub0', article_count=4,
+                         entities=Counter({ids[0]: 1, ids[1]: 3, ids[2]: 2}))
+    msgs = post.transform_for_database(top_n=2, vocab=vocab)
+    assert [doc for _, _, _, doc in msgs] == [
+        {'word': 'ent1', 'count': 3},
+        {'word': 'ent2', 'count': 2},
+        {'count': 4},
+    ]
+    assert msgs[-1][:3] == ('pub0', None, None)
+
+
+def test_stream_for_database_is_lazy():
+    post = ProcessedPost(publication='pub0', entities=Counter({'ent0': 2, 'ent1': 1}))
+    msgs = post.stream_for_database(top_n=1)
+    assert not isinstance(msgs, list)
+    assert [doc for _, _, _, doc in msgs] == [{'word': 'ent0', 'count': 2}, {'count': 0}]
+
+
+def test_entity_doc_id_is_stable():
+    # The expected value must never change, or documents will be duplicated.
+    assert entity_doc_id('new york') == '958689fdebaccfe7'
+    assert entity_doc_id(normalize_entity(' New York ')) == entity_doc_id('new york')
+    assert entity_doc_id('new jersey') != entity_doc_id('new york')
+
+
+def test_stream_for_database_uses_counted_words():
+    post = ProcessedPost(publication='pub0', entities=Counter({'new york': 1}))
+    _, _, doc_id, doc = next(post.stream_for_database())
+    assert doc == {'word': 'new york', 'count': 1}
+    assert doc_id == entity_doc_id('new york')
@@ -1,8 +1,16 @@
+from typing import Dict, Iterable, Tuple
+
 from google.cloud import firestore
 
 from .debugging import app_logger as log
 from .models import ProcessedPost
 
+# Firestore allows up to 500 writes per batch.
+MAX_BATCH_WRITES = 500
+# Increments are field transforms, which this client version sends as their own
+# write alongside the set. So each increment counts as two writes.
+WRITES_PER_INCREMENT = 2
+
 
 def persist_no_op(*args, **kwargs):
     pass
@@ -12,23 +20,55 @@ def get_database_client():
     return firestore.Client()
 
 
+def _increment_write(client, pubname, collname, doc_id, document_dict) -> Tuple[firestore.DocumentReference, Dict]:
+    '''Returns the document reference and document used to increment the counter for a message.'''
+    # pubdoc is the firestore document for the given publication.
+    pubdoc = client.collection(u'publications').document(pubname)
+    # Check these values to determine if this is a Publication count incrementor message.
+    if collname is None or doc_id is None:
+        return pubdoc, {'count': firestore.Increment(document_dict['count'])}
+    # wrddoc is the document that stores the word and count
+    wrddoc = pubdoc.collection(collname).document(doc_id)
+    # Map the increment class to the count value.
+    return wrddoc, {**document_dict, 'count': firestore.Increment(document_dict['count'])}
+
+
 def persist(client, pubname, collname, doc_id, document_dict):
 
     # Check these values to determine if this is a Publication count incrementor message.
     if collname is None or doc_id is None:
         increment_publication(client, pubname, document_dict['count'])
     else:
-        # Map the increment class to the count value.
-        document_dict['count'] = firestore.Increment(document_dict['count'])
-        # pubdoc is the firestore document for the given publication.
-        pubdoc = client.collection(u'publications').document(pubname)
-        # wrddoc is the document that stores the word and count
-        wrddoc = pubdoc.collection(collname).document(doc_id)
+        wrddoc, document_dict = _increment_write(client, pubname, collname, doc_id, document_dict)
         # Merge will allow the count to be incremented.
         wrddoc.set(document_dict, merge=True)
         log.debug('incremented word counter')
 
 
+def persist_batch(client, msgs: Iterable[Tuple[str, str, str, Dict]], max_writes: int = MAX_BATCH_WRITES) -> int:
+    '''Persists the given messages using batched writes.
+    Each batch holds up to max_writes writes and is committed with a single RPC.
+    Returns the number of commits.
+    '''
+    max_increments = max_writes // WRITES_PER_INCREMENT
+    batch, writes, commits = client.batch(), 0, 0
+    for msg in msgs:
+        # Merge will allow the count to be incremented.
+        batch.set(*_increment_write(client, *msg), merge=True)
+        writes += 1
+
+        if writes == max_increments:
+            batch.commit()
+            batch, writes, commits = client.batch(), 0, commits + 1
+
+    if writes:
+        batch.commit()
+        commits += 1
+
+    log.debug(f'committed {commits} batch(es)')
+    return commits
+
+
 def increment_publication(client, pubname, count):
     # pubdoc is the firestore document for the given publication.
     pubdoc = client.collection(u'publications').document(pubname)
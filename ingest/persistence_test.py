@@ -0,0 +1,121 @@
+import pytest
+from google.cloud import firestore
+from ingest.persistence import MAX_BATCH_WRITES, persist_batch
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+class Batch:
+    '''Records writes, and applies them to the client's documents on commit.
+    Like Firestore, each Increment counts as an additional write.
+    '''
+
+    def __init__(self, client):
+        self.client = client
+        self.writes = []
+        self.write_count = 0
+
+    def set(self, ref, document_dict, merge=False):
+        assert merge
+        self.writes.append(('set', ref.path, document_dict))
+        self.write_count += 1 + sum(isinstance(v, firestore.Increment) for v in document_dict.values())
+
+    def delete(self, ref):
+        self.writes.append(('delete', ref.path, None))
+        self.write_count += 1
+
+    def commit(self):
+        # Firestore rejects requests with more than 500 writes.
+        assert self.write_count <= MAX_BATCH_WRITES
+        for op, path, document_dict in self.writes:
+            if op == 'delete':
+                self.client.docs.pop(path, None)
+                continue
+            doc = self.client.docs.setdefault(path, {})
+            for key, value in document_dict.items():
+                doc[key] = doc.get(key, 0) + value.value if isinstance(value, firestore.Increment) else value
+        self.client.commits.append(self.writes)
+
+
+class Snapshot:
+    '''Like a DocumentSnapshot, holds the document's data from when it was read.'''
+
+    def __init__(self, client, path):
+        self.reference = Reference(client, path)
+        self.id = path.rsplit('/', 1)[1]
+        self._data = dict(client.docs.get(path, {}))
+
+    def get(self, field):
+        return self._data[field]
+
+
+class Reference:
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    def collection(self, name):
+        return Reference(self.client, f'{self.path}/{name}')
+
+    def document(self, name):
+        return Reference(self.client, f'{self.path}/{name}')
+
+    def stream(self):
+        prefix = f'{self.path}/'
+        paths = {prefix + p[len(prefix):].split('/')[0] for p in self.client.docs if p.startswith(prefix)}
+        return [Snapshot(self.client, path) for path in sorted(paths)]
+
+
+class Client(Reference):
+    '''A fake firestore client that stores documents by path in a dict,
+    and records the writes of each committed batch.
+    '''
+
+    def __init__(self, docs=None):
+        super(Client, self).__init__(self, '')
+        self.docs = {path: dict(doc) for path, doc in (docs or {}).items()}
+        self.commits = []
+
+    def batch(self):
+        return Batch(self)
+
+
+@pytest.fixture(scope='function')
+def client():
+    return Client()
+
+
+def messages(num):
+    for i in range(num):
+        yield 'pub0', 'ent', f'id{i}', {'word': f'ent{i}', 'count': i}
+    yield 'pub0', None, None, {'count': num}
+
+
+def test_persist_batch_commits(client):
+    assert persist_batch(client, messages(1099)) == 5
+    assert [len(writes) for writes in client.commits] == [250, 250, 250, 250, 100]
+
+
+def test_persist_batch_no_messages(client):
+    assert persist_batch(client, []) == 0
+    assert client.commits == []
+
+
+def test_persist_batch_writes(client):
+    persist_batch(client, messages(2))
+    persist_batch(client, messages(2))
+    assert client.docs == {
+        '/publications/pub0/ent/id0': {'word': 'ent0', 'count': 0},
+        '/publications/pub0/ent/id1': {'word': 'ent1', 'count': 2},
+        '/publications/pub0': {'count': 4},
+    }
@@ -8,29 +8,186 @@
 
 '''
 ###############################################################################
+import hashlib
+import re
+import time
 from collections import Counter
-from typing import Dict
+from typing import Dict, Iterator, List
 
 import spacy
 
 from .debugging import app_logger as log
-from .models import Post, ProcessedPost
+from .gazetteer import build_gazetteer_nlp, load_gazetteer
+from .lrucache import LRUCache
+from .models import EntityVocab, Post, ProcessedPost, normalize_entity
+
+
+# Entity labels that aren't counted.
+SKIP_LABELS = ('CARDINAL', 'MONEY', 'ORDINAL', 'DATE', 'TIME')
+# Pipeline components that the entity recognizer doesn't depend on.
+# Names that aren't part of the loaded model are ignored by spacy.load.
+NON_NER_PIPES = ('tagger', 'parser', 'lemmatizer', 'attribute_ruler', 'senter')
+# Zero-width patterns used to split text after line breaks, and after sentences.
+LINE_BOUNDARY = re.compile(r'(?<=\n)')
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?]\s)')
+# The supported entity extractors.
+EXTRACTORS = ('model', 'gazetteer')
+# The number of processed texts between logging the max and p99 processing times.
+TIMING_WINDOW = 1_000
+
+
+def latency_summary(timings: List[float]) -> Dict[str, float]:
+    '''Returns the max and 99th percentile of the given timings.'''
+    ordered = sorted(timings)
+    return {'max': ordered[-1], 'p99': ordered[int(0.99 * (len(ordered) - 1))]}
+
+
+def _text_pieces(text: str, chunk_chars: int) -> Iterator[str]:
+    '''Yields pieces of the text that are no longer than chunk_chars.
+    Text is split on line breaks, then sentence boundaries,
+    and as a last resort into pieces of exactly chunk_chars.
+    '''
+    for line in LINE_BOUNDARY.split(text):
+        if len(line) <= chunk_chars:
+            yield line
+            continue
+        for sentence in SENTENCE_BOUNDARY.split(line):
+            for start in range(0, len(sentence), chunk_chars):
+                yield sentence[start:start + chunk_chars]
+
+
+def chunk_text(text: str, chunk_chars: int = 0, max_chars: int = 0) -> List[str]:
+    '''Returns the text as a list of chunks of up to chunk_chars characters.
+    Text after the first max_chars characters is dropped.
+    Zero values disable chunking and the character cap.
+    '''
+    if max_chars:
+        text = text[:max_chars]
+    if not chunk_chars or len(text) <= chunk_chars:
+        return [text]
+
+    chunks, current = [], ''
+    for piece in _text_pieces(text, chunk_chars):
+        if len(current) + len(piece) > chunk_chars:
+            chunks.append(current)
+            current = ''
+        current += piece
+    if current:
+        chunks.append(current)
+    return chunks
 
 
 class DataProcessor():
 
-    def __init__(self):
-        log.info('spacy model loading')
-        self.nlp = spacy.load("en_core_web_sm")
-        log.info('spacy model loaded')
-        self.skip = ['CARDINAL', 'MONEY', 'ORDINAL', 'DATE', 'TIME']
+    def __init__(self, ner_only: bool = False, cache_bytes: int = 0, chunk_chars: int = 0, max_chars: int = 0,
+                 extractor: str = 'model', gazetteer_path: str = None, vocab_bytes: int = 0):
+        '''If ner_only is True the pipeline components that aren't required
+        for entity recognition are never loaded. That reduces startup time, 
+        memory used per process, and time spent processing each document.
+
+        If cache_bytes is set, the entities found in each text are cached,
+        keyed by a hash of the text. Syndicated articles, and resent datasets
+        repeat the same text many times, and cached texts skip spacy entirely.
+
+        Texts longer than chunk_chars are split into chunks which are processed
+        separately, so a single very long article doesn't stall the pipeline.
+        Texts are truncated to max_chars, which defaults to the model's max_length.
+
+        Entities are counted by their id in the vocab, which only grows.
+        Once its estimated size reaches vocab_bytes, vocab_full returns True,
+        and the owner of the counted ids should call reset_vocab when it no
+        longer holds any. Zero disables the limit.
+
+        The extractor determines how entities are found:
+            model:      the statistical en_core_web_sm model.
+            gazetteer:  matches against the entities listed in the gazetteer_path file.
+                        Much faster, but only finds entities that are already known.
+        '''
+        if extractor == 'model':
+            log.info('spacy model loading')
+            self.nlp = spacy.load("en_core_web_sm", disable=NON_NER_PIPES if ner_only else ())
+        elif extractor == 'gazetteer':
+            if not gazetteer_path:
+                raise ValueError('the gazetteer extractor requires a gazetteer_path')
+            log.info(f'gazetteer loading from {gazetteer_path}')
+            self.nlp = build_gazetteer_nlp(load_gazetteer(gazetteer_path))
+        else:
+            raise ValueError(f'unknown extractor, expected one of: {EXTRACTORS}')
+        log.info(f'spacy {extractor} loaded with pipes: {self.nlp.pipe_names}')
+        # Compare label ids rather than label strings.
+        self.skip = frozenset(self.nlp.vocab.strings[label] for label in SKIP_LABELS)
+        # Entities are counted by their id in this process's vocab.
+        self.vocab = EntityVocab()
+        self.vocab_bytes: int = vocab_bytes
+        self.cache = LRUCache(cache_bytes) if cache_bytes else None
+        self.chunk_chars: int = chunk_chars
+        self.max_chars: int = max_chars or self.nlp.max_length
+        # Seconds spent processing each of the recently processed texts.
+        self._timings: List[float] = []
 
     def entities(self, doc) -> Counter:
-        t = [e.text.lower() for e in doc.ents if e.label_ not in self.skip]
+        intern = self.vocab.intern
+        # Normalized before they're counted, so forms of the same entity share an id.
+        t = [intern(normalize_entity(e.text)) for e in doc.ents if e.label not in self.skip]
         return Counter(t)
 
+    def process_texts(self, texts: List[str], batch_size: int = 64) -> Iterator[Counter]:
+        '''Yields the entities Counter for each of the given texts, in order.
+        Texts that aren't cached are split into chunks and fed through nlp.pipe
+        which processes them in batches of batch_size, which is much faster than
+        calling self.nlp once per text.
+        '''
+        # The consumer may reset the vocab while texts are yielded, which makes
+        # the ids of hits looked up before the reset stale.
+        vocab = self.vocab
+        if self.cache is None:
+            keys = [None] * len(texts)
+            hits = keys
+        else:
+            keys = [hashlib.blake2b(text.encode(), digest_size=16).digest() for text in texts]
+            hits = [self.cache.get(key) for key in keys]
+
+        chunks = [chunk_text(text, self.chunk_chars, self.max_chars) if hit is None else []
+                  for text, hit in zip(texts, hits)]
+        docs = self.nlp.pipe((chunk for text_chunks in chunks for chunk in text_chunks), batch_size=batch_size)
+
+        for text, key, hit, text_chunks in zip(texts, keys, hits, chunks):
+            text_docs = docs
+            if hit is not None and self.vocab is not vocab:
+                # Processed again, rather than counting ids from the old vocab.
+                hit, text_chunks = None, chunk_text(text, self.chunk_chars, self.max_chars)
+                text_docs = self.nlp.pipe(text_chunks, batch_size=batch_size)
+            if hit is None:
+                hit, elapsed = Counter(), 0.0
+                for _ in text_chunks:
+                    # Only time spent by spacy is measured, not time spent by the consumer.
+                    # The pipe processes docs in batches, so the first doc of each batch
+                    # includes the time spent on the rest of the batch.
+                    start = time.perf_counter()
+                    doc = next(text_docs)
+                    elapsed += time.perf_counter() - start
+                    hit.update(self.entities(doc))
+                self._record_timing(elapsed, text_chunks)
+                if self.cache is not None:
+                    self.cache.put(key, hit)
+                    # Copied so that the cached Counter is never modified.
+                    hit = Counter(hit)
+            else:
+                hit = Counter(hit)
+            yield hit
+
+    def _record_timing(self, elapsed: float, text_chunks: List[str]):
+        log.debug(f'processed {sum(map(len, text_chunks))} chars in '
+                  f'{len(text_chunks)} chunk(s) in {elapsed * 1000:.1f}ms')
+        self._timings.append(elapsed)
+        if len(self._timings) >= TIMING_WINDOW:
+            summary = latency_summary(self._timings)
+            log.info(f'processed {len(self._timings)} texts: max {summary["max"] * 1000:.1f}ms, '
+                     f'p99 {summary["p99"] * 1000:.1f}ms')
+            self._timings = []
+
     def process(self, text: str) -> Dict:
-        return {'entities': self.entities(self.nlp(text))}
+        return {'entities': next(self.process_texts([text]))}
 
     def process_message(self, post) -> ProcessedPost:
         return ProcessedPost(
@@ -39,3 +196,32 @@ class DataProcessor():
                 **self.process(post['content'])
             }
         )
+
+    def process_messages(self, posts: List, batch_size: int = 64) -> Iterator[ProcessedPost]:
+        '''Yields a ProcessedPost for each of the given posts, in order.'''
+        entities = self.process_texts([post['content'] for post in posts], batch_size)
+        for post, ents in zip(posts, entities):
+            yield ProcessedPost(
+                **{
+                    **post,
+                    'entities': ents
+                }
+            )
+
+    def vocab_full(self) -> bool:
+        return bool(self.vocab_bytes and self.vocab.bytes >= self.vocab_bytes)
+
+    def reset_vocab(self):
+        '''Replaces the vocab. Ids from the old vocab must no longer be in use.
+        The result cache holds ids from the old vocab, so it's cleared too.
+        '''
+        log.info(f'resetting entity vocab: {len(self.vocab)} entities, ~{self.vocab.bytes} bytes')
+        self.vocab = EntityVocab()
+        if self.cache is not None:
+            self.cache.clear()
+
+    def cache_stats(self) -> Dict[str, float]:
+        '''Returns the result cache's hit rate and size, or an empty dict if it's disabled.'''
+        if self.cache is None:
+            return {}
+        return {'hit_rate': self.cache.hit_rate, 'entries': len(self.cache), 'bytes': self.cache.bytes}
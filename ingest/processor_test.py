@@ -0,0 +1,110 @@
+import pytest
+from types import SimpleNamespace
+from ingest.gazetteer import GAZETTEER_LABEL, save_gazetteer
+from ingest.processor import DataProcessor, chunk_text, latency_summary
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+text = 'Para one. Second sentence here!\nPara two is here.\n' + 'x' * 25 + '. tail'
+
+
+def test_chunk_text_disabled():
+    assert chunk_text(text) == [text]
+
+
+@pytest.mark.parametrize('chunk_chars', [10, 20, 30, 1000])
+def test_chunk_text_lossless(chunk_chars):
+    chunks = chunk_text(text, chunk_chars)
+    assert ''.join(chunks) == text
+    assert all(len(chunk) <= chunk_chars for chunk in chunks)
+
+
+def test_chunk_text_boundaries():
+    assert chunk_text(text, 30) == [
+        'Para one. ',
+        'Second sentence here!\n',
+        'Para two is here.\n',
+        'x' * 25 + '. ',
+        'tail',
+    ]
+
+
+def test_chunk_text_max_chars():
+    assert chunk_text(text, 20, max_chars=15) == ['Para one. Secon']
+
+
+def test_latency_summary():
+    timings = [i / 1000 for i in range(1, 201)]
+    assert latency_summary(timings) == {'max': 0.2, 'p99': 0.198}
+    assert latency_summary([0.5]) == {'max': 0.5, 'p99': 0.5}
+
+
+@pytest.fixture(scope='function')
+def gazetteer_path(tmp_path):
+    path = str(tmp_path / 'gazetteer.txt')
+    save_gazetteer(['New York', 'New York Times', 'Boston'], path)
+    return path
+
+
+def test_gazetteer_extractor(gazetteer_path):
+    processor = DataProcessor(extractor='gazetteer', gazetteer_path=gazetteer_path)
+    entities = processor.process('The New York Times moved from new york to Boston.')['entities']
+    assert {processor.vocab[entity_id]: count for entity_id, count in entities.items()} == {
+        'new york times': 1,
+        'new york': 1,
+        'boston': 1,
+    }
+
+
+def test_gazetteer_extractor_requires_path():
+    with pytest.raises(ValueError):
+        DataProcessor(extractor='gazetteer')
+
+
+def test_unknown_extractor():
+    with pytest.raises(ValueError):
+        DataProcessor(extractor='regex')
+
+
+def test_reset_vocab(gazetteer_path):
+    processor = DataProcessor(extractor='gazetteer', gazetteer_path=gazetteer_path,
+                              cache_bytes=1024 * 1024, vocab_bytes=1)
+    assert not processor.vocab_full()
+    processor.process('Boston')
+    assert processor.vocab_full()
+    assert len(processor.cache) == 1
+    processor.reset_vocab()
+    assert len(processor.vocab) == 0
+    assert len(processor.cache) == 0
+
+
+def test_reset_vocab_mid_batch(gazetteer_path):
+    processor = DataProcessor(extractor='gazetteer', gazetteer_path=gazetteer_path, cache_bytes=1024 * 1024)
+    texts = ['Boston and New York.', 'New York Times in Boston.']
+    list(processor.process_texts(texts))
+
+    # Both texts are cached, with ids from the vocab that's reset while they're yielded,
+    # the same as a worker flushing its cache in the middle of a batch.
+    entities = processor.process_texts(texts)
+    next(entities)
+    processor.reset_vocab()
+    words = {processor.vocab[entity_id]: count for entity_id, count in next(entities).items()}
+    assert words == {'new york times': 1, 'boston': 1}
+
+
+def test_entities_are_normalized(gazetteer_path):
+    processor = DataProcessor(extractor='gazetteer', gazetteer_path=gazetteer_path)
+    label = processor.nlp.vocab.strings[GAZETTEER_LABEL]
+    doc = SimpleNamespace(ents=[SimpleNamespace(text=text, label=label) for text in (' Boston', 'boston', 'BOSTON ')])
+    entities = processor.entities(doc)
+    assert {processor.vocab[entity_id]: count for entity_id, count in entities.items()} == {'boston': 3}
@@ -0,0 +1,52 @@
+###############################################################################
+'''
+    This module routes keys to backend nodes using consistent hashing.
+
+    Each node is placed on a hash ring at several points, its replicas.
+    A key belongs to the first node at or after the key's hash on the ring.
+    When a node joins or leaves, only the keys between it and its neighbours
+    move, so most publications keep being aggregated by the same node.
+
+    Nodes are configured statically as a comma separated list of host:port:
+        127.0.0.1:50000,127.0.0.1:50001
+'''
+###############################################################################
+import bisect
+import hashlib
+from typing import List, Tuple
+
+# A backend node's input queue manager address.
+Node = Tuple[str, int]
+
+
+def parse_nodes(spec: str) -> List[Node]:
+    '''Returns the nodes from a comma separated list of host:port.'''
+    nodes = []
+    for address in filter(None, (part.strip() for part in spec.split(','))):
+        host, _, port = address.rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError(f'expected host:port, got: {address}')
+        nodes.append((host, int(port)))
+    return nodes
+
+
+def _hash(key: str) -> int:
+    # A stable hash, unlike hash() which is randomized per process.
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing(object):
+    '''HashRing maps keys to nodes, placing each node on the ring replicas times.'''
+
+    def __init__(self, nodes: List[Node], replicas: int = 100):
+        if not nodes:
+            raise ValueError('at least one node is required')
+        self.nodes: List[Node] = list(nodes)
+        points = sorted((_hash(f'{host}:{port}#{i}'), (host, port)) for host, port in nodes for i in range(replicas))
+        self._hashes: List[int] = [point for point, _ in points]
+        self._nodes: List[Node] = [node for _, node in points]
+
+    def node(self, key: str) -> Node:
+        '''Returns the node the key belongs to.'''
+        index = bisect.bisect_left(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
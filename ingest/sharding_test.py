@@ -0,0 +1,52 @@
+import pytest
+from collections import Counter
+from ingest.sharding import HashRing, parse_nodes
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+nodes = [('127.0.0.1', 50000), ('127.0.0.1', 50001), ('127.0.0.1', 50002)]
+keys = [f'publication {i}' for i in range(3_000)]
+
+
+def test_parse_nodes():
+    assert parse_nodes('127.0.0.1:50000, 10.0.0.2:50001,') == [('127.0.0.1', 50000), ('10.0.0.2', 50001)]
+
+
+@pytest.mark.parametrize('spec', ['127.0.0.1', ':50000', '127.0.0.1:port'])
+def test_parse_nodes_invalid(spec):
+    with pytest.raises(ValueError):
+        parse_nodes(spec)
+
+
+def test_ring_requires_nodes():
+    with pytest.raises(ValueError):
+        HashRing([])
+
+
+def test_ring_is_stable():
+    ring, reordered = HashRing(nodes), HashRing(list(reversed(nodes)))
+    assert [ring.node(key) for key in keys] == [reordered.node(key) for key in keys]
+
+
+def test_ring_balances_keys():
+    counts = Counter(HashRing(nodes).node(key) for key in keys)
+    assert set(counts) == set(nodes)
+    assert min(counts.values()) > len(keys) / len(nodes) / 2
+
+
+def test_ring_only_moves_keys_of_changed_node():
+    before = HashRing(nodes)
+    after = HashRing(nodes + [('127.0.0.1', 50003)])
+    moved = [key for key in keys if before.node(key) != after.node(key)]
+    assert all(after.node(key) == ('127.0.0.1', 50003) for key in moved)
+    assert len(moved) < len(keys) / 2
@@ -0,0 +1,179 @@
+###############################################################################
+'''
+    This module provides a multiprocess queue backed by a shared memory
+    ring buffer, which can be used by a QueueWrapper in place of a
+    multiprocessing.Queue.
+
+    A multiprocessing.Queue sends each message through a feeder thread and a
+    pipe. SharedMemoryQueue copies each pickled message into a ring buffer of
+    length-prefixed records in shared memory, guarded by a single lock.
+    Any number of processes can put and get messages.
+
+    The buffer's header holds the read offset, the write offset, and the
+    number of records. The offsets only increase; their position in the
+    buffer is the offset modulo the capacity.
+
+'''
+###############################################################################
+import os
+import pickle
+import struct
+import time
+from multiprocessing import Condition, shared_memory
+from queue import Empty, Full
+from typing import Any, List
+
+# The read offset, the write offset, and the number of records.
+HEADER = struct.Struct('<QQQ')
+# The length of each record's pickled message.
+LENGTH = struct.Struct('<I')
+# The max number of seconds spent waiting before checking for deferred messages.
+WAIT_SLICE = 0.1
+
+
+class SharedMemoryQueue(object):
+    '''SharedMemoryQueue is a multi-producer, multi-consumer queue that uses a
+    ring buffer of capacity bytes in shared memory.
+
+    Unlike a multiprocessing.Queue it's bounded by bytes rather than messages:
+    put blocks while the buffer doesn't have room for the message.
+
+    Processes started with fork share the buffer with their parent. Processes
+    started with spawn attach to it by name when the queue is unpickled.
+    The process that created the queue should call unlink once every other
+    process is done with it.
+    '''
+
+    def __init__(self, capacity: int = 64 * 1024 * 1024):
+        self._capacity: int = capacity
+        self._shm = shared_memory.SharedMemory(create=True, size=HEADER.size + capacity)
+        HEADER.pack_into(self._shm.buf, 0, 0, 0, 0)
+        self._cond = Condition()
+        self._owner: int = os.getpid()
+        self._init_local()
+
+    def _init_local(self):
+        # Messages put by a signal handler that interrupted this process while
+        # it was using the buffer. They're written once the buffer is consistent.
+        self._busy: bool = False
+        self._deferred: List[bytes] = []
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'capacity': self._capacity, 'cond': self._cond, 'owner': self._owner}
+
+    def __setstate__(self, state):
+        self._capacity = state['capacity']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._cond = state['cond']
+        self._owner = state['owner']
+        self._init_local()
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def put(self, obj: object, block: bool = True, timeout: float = None):
+        '''Puts the pickled object in the buffer, waiting for room if needed.
+        Raises queue.Full if there's no room in time, and ValueError if the
+        pickled object can never fit in the buffer.
+        '''
+        record = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        if LENGTH.size + len(record) > self._capacity:
+            raise ValueError(f'message of {len(record)} bytes exceeds the queue capacity')
+        if self._busy:
+            # A signal handler interrupted this process's own put or get.
+            self._deferred.append(record)
+            return
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._busy = True
+            try:
+                while not self._room_for(record):
+                    self._wait(block, deadline, Full)
+                self._append(record)
+                self._flush_deferred()
+            finally:
+                self._busy = False
+
+    def get(self, block: bool = True, timeout: float = None) -> Any:
+        '''Removes and returns the oldest message, waiting for one if needed.
+        Raises queue.Empty if no message arrives in time.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._busy = True
+            try:
+                while True:
+                    self._flush_deferred()
+                    head, tail, count = HEADER.unpack_from(self._shm.buf, 0)
+                    if count:
+                        break
+                    self._wait(block, deadline, Empty)
+
+                length, = LENGTH.unpack(self._read(head, LENGTH.size))
+                record = self._read(head + LENGTH.size, length)
+                HEADER.pack_into(self._shm.buf, 0, head + LENGTH.size + length, tail, count - 1)
+                self._cond.notify_all()
+            finally:
+                self._busy = False
+        return pickle.loads(record)
+
+    def qsize(self) -> int:
+        '''Returns the approximate number of messages in the buffer.'''
+        return HEADER.unpack_from(self._shm.buf, 0)[2]
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def close(self):
+        '''Closes this process's mapping of the buffer.'''
+        self._shm.close()
+
+    def unlink(self):
+        '''Closes and frees the buffer. Only the creating process does anything.'''
+        if os.getpid() == self._owner:
+            self._shm.close()
+            self._shm.unlink()
+
+    def _wait(self, block: bool, deadline: float, error: type):
+        '''Waits for another process to notify, or raises error once the deadline passes.
+        Waiting is done in slices so deferred messages are written promptly.
+        '''
+        remaining = WAIT_SLICE if deadline is None else deadline - time.monotonic()
+        if not block or remaining <= 0:
+            raise error
+        self._cond.wait(min(remaining, WAIT_SLICE))
+
+    def _room_for(self, record: bytes) -> bool:
+        head, tail, _ = HEADER.unpack_from(self._shm.buf, 0)
+        return self._capacity - (tail - head) >= LENGTH.size + len(record)
+
+    def _flush_deferred(self):
+        while self._deferred and self._room_for(self._deferred[0]):
+            self._append(self._deferred.pop(0))
+
+    def _append(self, record: bytes):
+        '''Writes the record at the write offset. The caller must hold the lock.'''
+        head, tail, count = HEADER.unpack_from(self._shm.buf, 0)
+        self._write(tail, LENGTH.pack(len(record)))
+        self._write(tail + LENGTH.size, record)
+        HEADER.pack_into(self._shm.buf, 0, head, tail + LENGTH.size + len(record), count + 1)
+        self._cond.notify_all()
+
+    def _write(self, offset: int, data: bytes):
+        pos = offset % self._capacity
+        split = min(len(data), self._capacity - pos)
+        start = HEADER.size + pos
+        self._shm.buf[start:start + split] = data[:split]
+        if split < len(data):
+            self._shm.buf[HEADER.size:HEADER.size + len(data) - split] = data[split:]
+
+    def _read(self, offset: int, size: int) -> bytes:
+        pos = offset % self._capacity
+        split = min(size, self._capacity - pos)
+        start = HEADER.size + pos
+        data = bytes(self._shm.buf[start:start + split])
+        if split < size:
+            data += bytes(self._shm.buf[HEADER.size:HEADER.size + size - split])
+        return data
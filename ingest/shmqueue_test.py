@@ -0,0 +1,100 @@
+import pytest
+from multiprocessing import Process
+from queue import Empty, Full
+from ingest.messageq import QueueWrapper
+from ingest.shmqueue import SharedMemoryQueue
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+@pytest.fixture(scope='function')
+def shmq():
+    q = SharedMemoryQueue(capacity=256)
+    yield q
+    q.unlink()
+
+
+def test_put_get(shmq):
+    assert shmq.empty()
+    shmq.put('message1')
+    shmq.put({'count': 2})
+    assert shmq.qsize() == 2
+    assert shmq.get() == 'message1'
+    assert shmq.get() == {'count': 2}
+    assert shmq.empty()
+
+
+def test_get_timeout(shmq):
+    with pytest.raises(Empty):
+        shmq.get(timeout=0.01)
+    with pytest.raises(Empty):
+        shmq.get(block=False)
+
+
+def test_put_full(shmq):
+    with pytest.raises(Full):
+        for i in range(100):
+            shmq.put(f'message{i}', timeout=0.01)
+    assert shmq.qsize() == i
+
+
+def test_put_too_large(shmq):
+    with pytest.raises(ValueError):
+        shmq.put('x' * 256)
+
+
+def test_wraps_around(shmq):
+    # Records of varying sizes end up split across the end of the buffer.
+    for i in range(200):
+        msg = 'x' * (i % 37)
+        shmq.put(msg)
+        shmq.put(i)
+        assert shmq.get() == msg
+        assert shmq.get() == i
+    assert shmq.empty()
+
+
+def test_deferred_put(shmq):
+    # Puts made by a signal handler while the buffer is in use are written afterwards.
+    shmq._busy = True
+    shmq.put('STOP')
+    assert shmq.empty()
+    shmq._busy = False
+    assert shmq.get(timeout=1) == 'STOP'
+
+
+def producer(q, num):
+    for i in range(num):
+        q.put(i)
+    q.put('STOP')
+
+
+def test_across_processes(shmq):
+    procs = [Process(target=producer, args=(shmq, 100)) for _ in range(2)]
+    for p in procs:
+        p.start()
+    msgs = []
+    while msgs.count('STOP') < 2:
+        msgs.append(shmq.get(timeout=5))
+    for p in procs:
+        p.join()
+    assert sorted(msg for msg in msgs if msg != 'STOP') == sorted(list(range(100)) * 2)
+
+
+def test_queue_wrapper(shmq):
+    queue_wrapper = QueueWrapper('testq', q=shmq, codec='marshal')
+    queue_wrapper.put_batch([('pub0', 'ent', 'id0', {'count': 1})] * 3, chunk_size=2)
+    queue_wrapper.q.put('STOP')
+    assert queue_wrapper.get_batch() == [('pub0', 'ent', 'id0', {'count': 1})] * 3
+    assert queue_wrapper.get_batch() == 'STOP'
+    queue_wrapper.prevent_writes()
+    assert queue_wrapper.is_drained
@@ -12,6 +12,10 @@ class ShutdownWatcher:
 
         with ShutdownWatcher() as watcher:
             watcher.serve_forever() # <-- Blocks until signaled.
+
+        A callback can be run every interval seconds while serving:
+
+            watcher.serve_forever(autoscaler.tick, interval=5.0)
     """
 
     def __init__(self):
@@ -26,9 +30,13 @@ class ShutdownWatcher:
     def __exit__(self, *args, **kwargs):
         self.exit()
 
-    def serve_forever(self):
+    def serve_forever(self, callback: Callable = None, interval: float = 1.0):
+        next_call = time.monotonic() + interval
         while self.should_continue:
             time.sleep(0.1)
+            if callback and time.monotonic() >= next_call:
+                callback()
+                next_call = time.monotonic() + interval
 
     def exit(self, *args, **kwargs):
         self.should_continue = False
@@ -37,3 +37,17 @@ def test_shutdown_manager(watcher, sig):
         w.serve_forever()
 
     assert not watcher.should_continue
+
+
+def test_serve_forever_callback(watcher):
+    calls = []
+
+    def callback():
+        calls.append(time.monotonic())
+        if len(calls) == 3:
+            watcher.exit()
+
+    with watcher as w:
+        w.serve_forever(callback, interval=0.1)
+
+    assert len(calls) == 3
@@ -0,0 +1,270 @@
+###############################################################################
+'''
+    This module provides a durable write-ahead spool for queue messages.
+
+    Messages are pickled and appended to segment files as records, each with
+    its offset, length, and a crc32 of the message. The segment's file name
+    is the offset of its first record. Writes are sequential and fsynced in
+    batches, at most sync_interval seconds after they're appended.
+
+    Consumers acknowledge the offsets of the messages they no longer need,
+    which are appended to an ack file per process. Once every record in a
+    segment is acknowledged, the segment is deleted. Once every offset in an
+    ack file belongs to a deleted segment, the process starts a new ack file.
+
+    A spool opened in a directory used before recovers the records that
+    were never acknowledged. They're appended again, so they're durable
+    under their new offsets, and the old segments and ack files are deleted.
+    Messages are delivered at least once: a message acknowledged after a
+    crash, but before its ack was synced, is recovered again.
+
+    Directory layout:
+        00000000000000000000.seg
+        00000000000000052311.seg
+        acks-1234-0.log
+'''
+###############################################################################
+import bisect
+import glob
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from .debugging import app_logger as log
+
+# The offset, length, and crc32 of each record's pickled message.
+RECORD = struct.Struct('<QII')
+# Each acknowledged offset.
+ACK = struct.Struct('<Q')
+
+
+# A message put on a queue along with its offset in the spool.
+Spooled = namedtuple('Spooled', ['offset', 'payload'])
+
+
+class Spool(object):
+    '''Spool appends messages to segment files in the given directory.
+    Segments are rolled over once they reach segment_bytes.
+
+    Only one process appends to the spool, but it's thread safe, since the
+    queue manager serves each connection from its own thread.
+    Any process may acknowledge offsets.
+    '''
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024, sync_interval: float = 0.05):
+        self.directory: str = directory
+        self.segment_bytes: int = segment_bytes
+        self.sync_interval: float = sync_interval
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = None
+        self._size: int = 0
+        self._dirty: bool = False
+        self._syncer_pid: int = None
+        # The base offset of each segment written by this spool, and the
+        # number of its records that are known to be acknowledged.
+        self._segments: List[int] = []
+        self._acked: Dict[int, int] = {}
+        self._ack_positions: Dict[str, int] = {}
+        # The ack file of the process acknowledging offsets, and the largest offset in it.
+        # Once every segment those offsets belong to is deleted, the file is rotated.
+        self._ack_pid: int = None
+        self._ack_generation: int = 0
+        self._ack_max: int = None
+
+        self._recovering: List[str] = self._segment_paths()
+        self._recovering_acks: List[str] = self._ack_paths()
+        self._next_offset: int = self._first_unused_offset(self._recovering)
+        # A process forked while another thread held the lock would never get it.
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def _segment_paths(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, '*.seg')))
+
+    def _ack_paths(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, 'acks-*.log')))
+
+    def _segment_path(self, base: int) -> str:
+        return os.path.join(self.directory, f'{base:020d}.seg')
+
+    def append(self, obj: object) -> int:
+        '''Appends the object to the spool and returns its offset.'''
+        return self._append(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def _append(self, payload: bytes) -> int:
+        with self._lock:
+            if self._file is None or self._size >= self.segment_bytes:
+                self._roll()
+            offset = self._next_offset
+            self._next_offset += 1
+            self._file.write(RECORD.pack(offset, len(payload), zlib.crc32(payload)))
+            self._file.write(payload)
+            self._size += RECORD.size + len(payload)
+            self._dirty = True
+        self._start_syncer()
+        return offset
+
+    def _roll(self):
+        '''Starts a new segment. The caller must hold the lock.'''
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+        base = self._next_offset
+        self._file = open(self._segment_path(base), 'ab')
+        self._size = 0
+        self._segments.append(base)
+        self._acked[base] = 0
+        self._compact()
+
+    def _start_syncer(self):
+        '''Starts a thread that syncs appended records in the appending process.'''
+        if self._syncer_pid == os.getpid():
+            return
+        self._syncer_pid = os.getpid()
+        threading.Thread(target=self._sync_forever, name='spool-sync', daemon=True).start()
+
+    def _sync_forever(self):
+        while True:
+            time.sleep(self.sync_interval)
+            self.sync()
+
+    def sync(self):
+        '''Flushes and fsyncs the appended records.'''
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._dirty:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def ack(self, offsets: Iterable[int]):
+        '''Durably records that the messages at the given offsets are no longer needed.'''
+        offsets = list(offsets)
+        if not offsets:
+            return
+        if self._ack_pid != os.getpid():
+            self._ack_pid, self._ack_generation, self._ack_max = os.getpid(), 0, None
+        elif self._ack_max is not None and self._ack_max < self._first_segment_base():
+            self._rotate_acks()
+        with open(self._ack_path(), 'ab') as f:
+            f.write(b''.join(ACK.pack(offset) for offset in offsets))
+            f.flush()
+            os.fsync(f.fileno())
+        self._ack_max = max(offsets if self._ack_max is None else offsets + [self._ack_max])
+
+    def _ack_path(self) -> str:
+        return os.path.join(self.directory, f'acks-{self._ack_pid}-{self._ack_generation}.log')
+
+    def _first_segment_base(self) -> int:
+        paths = self._segment_paths()
+        return int(os.path.basename(paths[0]).split('.')[0]) if paths else self._ack_max + 1
+
+    def _rotate_acks(self):
+        '''Deletes this process's ack file, since every offset in it belongs to a deleted segment.'''
+        os.remove(self._ack_path())
+        self._ack_generation += 1
+        self._ack_max = None
+
+    def _compact(self):
+        '''Deletes the closed segments whose records are all acknowledged.
+        Each ack file is only read from where the last compaction stopped.
+        The caller must hold the lock.
+        '''
+        paths = self._ack_paths()
+        # Rotated ack files only held offsets of deleted segments.
+        for path in set(self._ack_positions) - set(paths):
+            del self._ack_positions[path]
+        for path in paths:
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(self._ack_positions.get(path, 0))
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            data = data[:len(data) - len(data) % ACK.size]
+            self._ack_positions[path] = self._ack_positions.get(path, 0) + len(data)
+            ends = self._segments[1:] + [self._next_offset]
+            for offset, in ACK.iter_unpack(data):
+                index = bisect.bisect_right(self._segments, offset) - 1
+                if index >= 0 and offset < ends[index]:
+                    self._acked[self._segments[index]] += 1
+
+        # The last segment is the one being written.
+        for base, end in list(zip(self._segments, self._segments[1:])):
+            if self._acked[base] >= end - base:
+                log.info(f'deleting acknowledged spool segment {base}')
+                os.remove(self._segment_path(base))
+                self._segments.remove(base)
+                del self._acked[base]
+
+    def recover(self) -> Iterator[Tuple[int, object]]:
+        '''Yields the offset and message of each record that was spooled, but
+        not acknowledged, before this spool was opened. Each message is appended
+        again before it's yielded, and the offset is its new offset.
+        Once every record is recovered the old segments and ack files are deleted.
+        '''
+        acked = self._read_acks(self._recovering_acks)
+        recovered = 0
+        for path in self._recovering:
+            for offset, payload in self._read_segment(path):
+                if offset not in acked:
+                    recovered += 1
+                    yield self._append(payload), pickle.loads(payload)
+        self.sync()
+        for path in self._recovering + self._recovering_acks:
+            os.remove(path)
+        self._recovering, self._recovering_acks = [], []
+        log.info(f'recovered {recovered} unacknowledged message(s) from the spool')
+
+    @staticmethod
+    def _read_acks(paths: List[str]) -> Set[int]:
+        acked = set()
+        for path in paths:
+            with open(path, 'rb') as f:
+                data = f.read()
+            data = data[:len(data) - len(data) % ACK.size]
+            acked.update(offset for offset, in ACK.iter_unpack(data))
+        return acked
+
+    @staticmethod
+    def _read_segment(path: str) -> Iterator[Tuple[int, bytes]]:
+        '''Yields each complete record in the segment.
+        Reading stops at a torn record, which was being written during a crash.
+        '''
+        if os.path.getsize(path) == 0:
+            return
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            pos = 0
+            while pos + RECORD.size <= len(buf):
+                offset, length, crc = RECORD.unpack_from(buf, pos)
+                payload = buf[pos + RECORD.size:pos + RECORD.size + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    log.info(f'ignoring torn record at offset {offset} in {path}')
+                    return
+                yield offset, payload
+                pos += RECORD.size + length
+
+    @classmethod
+    def _first_unused_offset(cls, paths: List[str]) -> int:
+        '''Returns an offset after every record, and every segment's base offset.'''
+        if not paths:
+            return 0
+        unused = int(os.path.basename(paths[-1]).split('.')[0]) + 1
+        for path in reversed(paths):
+            last = None
+            for last, _ in cls._read_segment(path):
+                pass
+            if last is not None:
+                return max(unused, last + 1)
+        return unused
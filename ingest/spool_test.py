@@ -0,0 +1,97 @@
+import os
+
+from ingest.messageq import QueueWrapper
+from ingest.spool import ACK, RECORD, Spool
+
+
+def teardown_function():
+    """Remove handlers from all loggers"""
+    import logging
+    loggers = [logging.getLogger()] + \
+        list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        handlers = getattr(logger, 'handlers', [])
+        for handler in handlers:
+            logger.removeHandler(handler)
+
+
+def segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.seg'))
+
+
+def test_append_offsets(tmp_path):
+    spool = Spool(str(tmp_path))
+    assert [spool.append(f'message{i}') for i in range(3)] == [0, 1, 2]
+    spool.sync()
+    assert segments(tmp_path) == ['00000000000000000000.seg']
+
+
+def test_recover_unacknowledged(tmp_path):
+    spool = Spool(str(tmp_path))
+    for i in range(4):
+        spool.append(f'message{i}')
+    spool.sync()
+    spool.ack([0, 2])
+
+    recovered = Spool(str(tmp_path))
+    assert list(recovered.recover()) == [(4, 'message1'), (5, 'message3')]
+    assert segments(tmp_path) == ['00000000000000000004.seg']
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('acks-')]
+
+    # The recovered messages are spooled again under their new offsets.
+    assert list(Spool(str(tmp_path)).recover()) == [(6, 'message1'), (7, 'message3')]
+
+
+def test_recover_ignores_torn_record(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append('message0')
+    spool.append('message1')
+    spool.sync()
+    path = tmp_path / segments(tmp_path)[0]
+    os.truncate(path, os.path.getsize(path) - 1)
+
+    assert list(Spool(str(tmp_path)).recover()) == [(1, 'message0')]
+
+
+def test_acknowledged_segments_are_deleted(tmp_path):
+    # Each segment holds a single record.
+    spool = Spool(str(tmp_path), segment_bytes=RECORD.size)
+    spool.append('message0')
+    spool.append('message1')
+    spool.ack([0])
+    spool.append('message2')
+    assert segments(tmp_path) == ['00000000000000000001.seg', '00000000000000000002.seg']
+
+
+def test_ack_files_are_rotated(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=RECORD.size)
+    spool.append('message0')
+    spool.append('message1')
+    spool.ack([0])
+    spool.append('message2')
+
+    # Every offset in the ack file belongs to a deleted segment, so it's replaced.
+    spool.ack([1])
+    acks = [name for name in os.listdir(tmp_path) if name.startswith('acks-')]
+    assert acks == [f'acks-{os.getpid()}-1.log']
+    assert os.path.getsize(tmp_path / acks[0]) == ACK.size
+
+    spool.append('message3')
+    spool.sync()
+    assert segments(tmp_path) == ['00000000000000000002.seg', '00000000000000000003.seg']
+    assert list(Spool(str(tmp_path)).recover()) == [(4, 'message2'), (5, 'message3')]
+
+
+def test_queue_wrapper_spool(tmp_path):
+    queue_wrapper = QueueWrapper('testq', spool=Spool(str(tmp_path)), codec='marshal')
+    queue_wrapper.put_many([{'content': f'text{i}'} for i in range(3)])
+    assert queue_wrapper.get_many(2, 0.1) == [{'content': 'text0'}, {'content': 'text1'}]
+    queue_wrapper.ack(1)
+    queue_wrapper._spool.sync()
+
+    # After a crash, the unacknowledged messages are put back on a new queue.
+    restarted = QueueWrapper('testq', spool=Spool(str(tmp_path)), codec='marshal')
+    assert restarted.replay() == 2
+    assert restarted.get_many(5, 0.1) == [{'content': 'text1'}, {'content': 'text2'}]
+    restarted.ack()
+    assert QueueWrapper('testq', spool=Spool(str(tmp_path))).replay() == 0
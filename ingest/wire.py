@@ -0,0 +1,57 @@
+###############################################################################
+'''
+    This module provides the wire formats used by QueueWrapper to encode
+    messages before they're put on a queue.
+
+    Queues pickle whatever is put on them. Encoding messages into a compact
+    format first means the queue only has to pickle a bytes object, which
+    is little more than a copy.
+
+    marshal:    built-in types only. Fast, and part of the standard library.
+    msgpack:    built-in types only. Compact. Requires: pip install ingestion[msgpack]
+
+    Without a codec, messages are left for the queue to pickle.
+'''
+###############################################################################
+import marshal
+from typing import Any
+
+
+class MarshalCodec(object):
+    name = 'marshal'
+
+    def encode(self, obj: Any) -> bytes:
+        return marshal.dumps(obj)
+
+    def decode(self, data: bytes) -> Any:
+        return marshal.loads(data)
+
+
+class MsgpackCodec(object):
+    '''Tuples are decoded as lists, as msgpack only has one array type.'''
+    name = 'msgpack'
+
+    def __init__(self):
+        try:
+            import msgpack  # noqa
+        except ImportError:
+            raise ImportError('the msgpack codec requires: pip install ingestion[msgpack]')
+
+    def encode(self, obj: Any) -> bytes:
+        import msgpack
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data: bytes) -> Any:
+        import msgpack
+        return msgpack.unpackb(data, raw=False)
+
+
+CODECS = {codec.name: codec for codec in (MarshalCodec, MsgpackCodec)}
+
+
+def get_codec(name: str):
+    '''Returns an instance of the named codec.'''
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f'unknown codec, expected one of: {list(CODECS)}')
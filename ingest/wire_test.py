@@ -0,0 +1,23 @@
+import pytest
+from ingest.wire import CODECS, get_codec
+
+messages = [
+    {'content': 'The quick brown fox.', 'publication': 'pub0'},
+    [('pub0', 'ent', 'id0', {'word': 'ent0', 'count': 1}), ('pub0', None, None, {'count': 1})],
+]
+
+
+@pytest.mark.parametrize('name', list(CODECS))
+@pytest.mark.parametrize('msg', messages)
+def test_round_trip(name, msg):
+    if name == 'msgpack':
+        pytest.importorskip('msgpack')
+    codec = get_codec(name)
+    data = codec.encode(msg)
+    assert isinstance(data, bytes)
+    decoded = codec.decode(data)
+    expected = msg
+    # msgpack decodes tuples as lists.
+    if name == 'msgpack' and isinstance(msg, list):
+        expected = [list(m) for m in msg]
+    assert decoded == expected
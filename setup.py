@@ -11,6 +11,8 @@ setup(
     packages=find_packages(),
     entry_points={"console_scripts": [
         "ingestiond=ingest.backend:main",
+        "compactentities=ingest.compaction:main",
+        "buildgazetteer=ingest.gazetteer:main",
         "getdataset=simulator.download:download_and_extract",
         "uploaddataset=simulator.upload:main",
     ]},
@@ -38,7 +40,13 @@ setup(
             "falcon",
             "falcon==2.0.0",
             "google-cloud-storage==1.29.0",
-        ]
+        ],
+        "msgpack": [
+            "msgpack==1.0.0",
+        ],
+        "orjson": [
+            "orjson==3.4.0",
+        ],
     }
 
 )
@@ -2,6 +2,7 @@ import csv
 import typer
 import httpx
 import asyncio
+from itertools import islice
 
 csv.field_size_limit(csv.field_size_limit() * 5)
 
@@ -28,8 +29,23 @@ async def upload_to_uri(uri: str, record_count):
         print(f"submitted {record_count} records")
 
 
-def runner(uri: str = 'http://0.0.0.0:8000/post/enqueue', record_count: int = 10):
-    asyncio.run(upload_to_uri(uri, record_count))
+async def upload_batches_to_uri(uri: str, record_count, batch_size):
+    async with httpx.AsyncClient(verify=False, http2=True, headers={"access_token": "ijdf8h74nj"}) as c:
+        row = get_data()
+        next(row)  # Remove the header row
+        for start in range(0, record_count, batch_size):
+            batch = list(islice(row, min(batch_size, record_count - start)))
+            await c.post(uri, json=batch, timeout=30)
+
+        print(f"submitted {record_count} records in batches of {batch_size}")
+
+
+def runner(uri: str = 'http://0.0.0.0:8000/post/enqueue', record_count: int = 10,
+           batch_uri: str = 'http://0.0.0.0:8000/post/enqueue_batch', batch_size: int = 1):
+    if batch_size > 1:
+        asyncio.run(upload_batches_to_uri(batch_uri, record_count, batch_size))
+    else:
+        asyncio.run(upload_to_uri(uri, record_count))
 
 
 def main():
@@ -1,7 +1,12 @@
 import hashlib
 import io
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from urllib.parse import urljoin
-from typing import Any, Dict, Generator, Tuple
+from typing import Any, Callable, Dict, Generator, Hashable, Iterable, Iterator, Tuple
 
 from google.cloud import firestore, storage
 from google.cloud.storage import Blob
@@ -11,6 +16,7 @@ from wordcloud import WordCloud
 
 from .models import Publication, WordCount
 
+logger = logging.getLogger()
 
 def get_client(_type='db'):
     '''get_client returns a client used for accessessing data or blob storage. 
@@ -131,6 +137,95 @@ class NoOpDataStorage():
         return {wc.word: wc.count for wc in self.word_counts(publ, top_n, checkpoint)}
 
 
+class CachedDataStorage():
+    '''Wraps a DataStorage, caching the results of its queries.
+
+    Results are fresh for ttl seconds, and then stale for another stale_ttl
+    seconds. Stale results are returned while a background thread refreshes
+    them. After that they're refreshed before returning. ttls overrides the
+    ttl per method, for example: {'publications': 60, 'word_counts': 10}.
+
+    Concurrent requests for the same uncached results wait for a single
+    query, rather than each querying the database.
+    At most max_entries results are cached, evicting the least recently used.
+    '''
+
+    def __init__(self, data_storage: DataStorage, ttl: float = 30.0, stale_ttl: float = 300.0,
+                 max_entries: int = 1024, ttls: Dict[str, float] = None, clock: Callable[[], float] = time.monotonic):
+        self._storage = data_storage
+        self._ttls: Dict[str, float] = {'publications': ttl, 'word_counts': ttl, **(ttls or {})}
+        self._stale_ttl: float = stale_ttl
+        self._max_entries: int = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Each key's results, and the times until which they're fresh and stale.
+        self._entries: OrderedDict = OrderedDict()
+        # The queries currently running for each key.
+        self._loading: Dict[Hashable, Future] = {}
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+
+    def publications(self, bucket_name: str = None) -> Iterator[Publication]:
+        return iter(self._get(('publications', bucket_name), lambda: self._storage.publications(bucket_name)))
+
+    def word_counts(self, publ: str, top_n: int = 10, checkpoint: Tuple[str, int] = None) -> Iterator[WordCount]:
+        checkpoint = tuple(checkpoint) if checkpoint else None
+        key = ('word_counts', publ, top_n, checkpoint)
+        return iter(self._get(key, lambda: self._storage.word_counts(publ, top_n, checkpoint)))
+
+    def frequencies(self, publ: str, top_n: int = 10, checkpoint: Tuple[str, int] = None) -> Dict[str, int]:
+        return {wc.word: wc.count for wc in self.word_counts(publ, top_n, checkpoint)}
+
+    def _get(self, key: Tuple, query: Callable[[], Iterable]) -> Tuple:
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                value, fresh_until, stale_until = entry
+                if now < fresh_until:
+                    return value
+                if now < stale_until:
+                    if key not in self._loading:
+                        future = self._loading[key] = Future()
+                        future.add_done_callback(self._log_refresh_error)
+                        self._refresher.submit(self._load, key, query, future)
+                    return value
+
+            future = self._loading.get(key)
+            leader = future is None
+            if leader:
+                future = self._loading[key] = Future()
+
+        if leader:
+            self._load(key, query, future)
+        return future.result()
+
+    def _load(self, key: Tuple, query: Callable[[], Iterable], future: Future):
+        '''Runs the query, caches its results, and resolves the future with them.'''
+        try:
+            value = tuple(query())
+        except Exception as ex:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(ex)
+            return
+
+        now, ttl = self._clock(), self._ttls[key[0]]
+        with self._lock:
+            self._entries[key] = (value, now + ttl, now + ttl + self._stale_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+            del self._loading[key]
+        future.set_result(value)
+
+    @staticmethod
+    def _log_refresh_error(future: Future):
+        # The stale results are kept, and refreshed again by the next request.
+        if future.exception() is not None:
+            logger.error('unable to refresh cached results', exc_info=future.exception())
+
+
 class BlobStorage():
 
     def __init__(self, client: storage.Client):
@@ -1,4 +1,5 @@
 import os
+import threading
 import pytest
 from unittest.mock import Mock, patch
 from PIL import Image
@@ -6,7 +7,7 @@ from google.cloud import firestore
 from google.cloud.storage import Blob
 from google.cloud import storage
 from wordcloud.wordcloud import WordCloud
-from .data import (get_client, image_to_byte_array, DataStorage,
+from .data import (get_client, image_to_byte_array, CachedDataStorage, DataStorage,
                    NoOpDataStorage, generate_word_cloud, image_url_path)
 
 black_square = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x80\x00\x00\x00\x80\x08\x02\x00\x00\x00L\\\xf6\x9c\x00\x00\x00DIDATx\x9c\xed\xc1\x01\x01\x00\x00\x00\x80\x90\xfe\xaf\xee\x08\n\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x18\xc0\x80\x00\x01c\x16u\x00\x00\x00\x00\x00IEND\xaeB`\x82'
@@ -142,3 +143,121 @@ def test_generate_word_cloud_invalid_fmt():
 def test_image_url_path(_in, _out):
     assert image_url_path('pub0') == '/f049522a75b637e2ce4445cd443e96e9.png'
     assert image_url_path('pub0', _in) == _out
+
+
+class CountingStorage(NoOpDataStorage):
+    """Counts the queries made, optionally blocking each one until released."""
+
+    def __init__(self, release: threading.Event = None):
+        self.queries = 0
+        self.release = release
+        self.fail = False
+
+    def publications(self, bucket_name: str = None):
+        self.queries += 1
+        if self.release:
+            self.release.wait(5)
+        if self.fail:
+            raise RuntimeError('database is unavailable')
+        return super().publications(bucket_name)
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cached_storage_results(data_storage):
+    cached = CachedDataStorage(data_storage)
+    assert list(cached.publications()) == list(data_storage.publications())
+    assert list(cached.word_counts('pub0', checkpoint=('ent1', 1))) == list(data_storage.word_counts('pub0', checkpoint=('ent1', 1)))
+    assert cached.frequencies('pub0') == data_storage.frequencies('pub0')
+
+
+def test_cached_storage_ttl():
+    storage, clock = CountingStorage(), Clock()
+    cached = CachedDataStorage(storage, ttl=10, stale_ttl=0, clock=clock)
+    list(cached.publications())
+    clock.now = 9
+    list(cached.publications())
+    assert storage.queries == 1
+    clock.now = 10
+    list(cached.publications())
+    assert storage.queries == 2
+
+
+def test_cached_storage_per_method_ttl():
+    storage, clock = CountingStorage(), Clock()
+    cached = CachedDataStorage(storage, ttl=10, stale_ttl=0, ttls={'publications': 60}, clock=clock)
+    list(cached.publications())
+    clock.now = 30
+    list(cached.publications())
+    assert storage.queries == 1
+
+
+def test_cached_storage_keys():
+    storage = CountingStorage()
+    cached = CachedDataStorage(storage)
+    list(cached.publications())
+    list(cached.publications('bucket'))
+    list(cached.publications())
+    assert storage.queries == 2
+
+
+def test_cached_storage_lru():
+    storage = CountingStorage()
+    cached = CachedDataStorage(storage, max_entries=2)
+    for bucket in ['b0', 'b1', 'b0', 'b2', 'b0']:
+        list(cached.publications(bucket))
+    # b1 was the least recently used when b2 was cached.
+    assert storage.queries == 3
+    list(cached.publications('b1'))
+    assert storage.queries == 4
+
+
+def test_cached_storage_single_flight():
+    release = threading.Event()
+    storage = CountingStorage(release)
+    cached = CachedDataStorage(storage)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(list(cached.publications()))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert storage.queries == 1
+    assert len(results) == 10
+    assert all(result == results[0] for result in results)
+
+
+def test_cached_storage_stale_while_revalidate():
+    release = threading.Event()
+    storage, clock = CountingStorage(release), Clock()
+    release.set()
+    cached = CachedDataStorage(storage, ttl=10, stale_ttl=60, clock=clock)
+    expected = list(cached.publications())
+
+    # Stale results are returned right away, while they're refreshed in the background.
+    release.clear()
+    clock.now = 20
+    assert list(cached.publications()) == expected
+    assert list(cached.publications()) == expected
+    release.set()
+    cached._refresher.shutdown(wait=True)
+    assert storage.queries == 2
+
+
+def test_cached_storage_errors():
+    storage, clock = CountingStorage(), Clock()
+    storage.fail = True
+    cached = CachedDataStorage(storage, ttl=10, stale_ttl=0, clock=clock)
+    with pytest.raises(RuntimeError):
+        list(cached.publications())
+    storage.fail = False
+    assert len(list(cached.publications())) == 10
+    assert storage.queries == 2
@@ -0,0 +1,244 @@
+'''
+    Runs word cloud generation jobs in the background.
+
+    Each publication's image is generated in three steps:
+        1.) Its frequencies are fetched on a thread pool.
+        2.) Its image is generated on a process pool, using every core.
+        3.) The image is uploaded on the thread pool.
+
+    The steps of different publications overlap, so while some images are
+    being generated, frequencies for others are fetched, and finished images
+    are uploaded.
+
+    Images are only regenerated for publications that changed. A fingerprint
+    of each uploaded image is kept: the publication's count, and a digest of
+    the frequencies it was generated from. Publications whose count changed
+    by no more than the threshold are skipped without fetching frequencies,
+    and those whose frequencies digest is unchanged aren't regenerated.
+'''
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional
+
+from .data import generate_word_cloud
+from .models import Publication
+
+logger = logging.getLogger()
+
+# The count and frequencies of a publication when its image was generated.
+Fingerprint = namedtuple('Fingerprint', ['count', 'digest'])
+
+
+def frequencies_digest(freqs: Dict[str, int]) -> str:
+    '''Returns a digest of the frequencies, independent of their order.'''
+    data = json.dumps(sorted(freqs.items()), separators=(',', ':')).encode()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def count_changed(old: int, new: int, threshold: float) -> bool:
+    '''Returns True if new differs from old by more than the threshold, a fraction of old.'''
+    return abs(new - old) > threshold * old
+
+
+class WordCloudJob(object):
+    '''Tracks the progress of generating each publication's word cloud.'''
+
+    def __init__(self):
+        self.id: str = uuid.uuid4().hex
+        self.state: str = 'running'
+        self.total: Optional[int] = None
+        self.completed: int = 0
+        self.skipped: int = 0
+        self.failed: List[str] = []
+        self.started: float = time.time()
+        self.finished: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.state == 'running'
+
+    def start(self, total: int):
+        with self._lock:
+            self.total = total
+            self._finish_if_done()
+
+    def publication_done(self, name: str, error: BaseException = None):
+        with self._lock:
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed.append(name)
+            self._finish_if_done()
+
+    def publication_skipped(self, name: str):
+        with self._lock:
+            self.skipped += 1
+            self._finish_if_done()
+
+    def fail(self):
+        with self._lock:
+            self.state, self.finished = 'failed', time.time()
+
+    def _finish_if_done(self):
+        if self.total is not None and self.completed + self.skipped + len(self.failed) >= self.total:
+            self.state, self.finished = 'done', time.time()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'id': self.id,
+                'state': self.state,
+                'total': self.total,
+                'completed': self.completed,
+                'skipped': self.skipped,
+                'failed': list(self.failed),
+                'started': self.started,
+                'finished': self.finished,
+            }
+
+
+class WordCloudJobRunner(object):
+    '''Runs a WordCloudJob at a time, generating an image for every publication
+    that changed since its image was generated.
+    Submitting while a job is running returns the running job, so repeated
+    requests can't queue up more work.
+    The most recent max_jobs jobs are kept, so their status can be reported.
+
+    threshold is the fraction a publication's count has to change by for its
+    image to be regenerated; 0 regenerates it on any change.
+    '''
+
+    def __init__(self, blob_storage, data_storage, bucket_name: str, top_n: int = 5000,
+                 processes: int = None, threads: int = 8, max_jobs: int = 10, threshold: float = 0.0):
+        self._blob_storage = blob_storage
+        self._data_storage = data_storage
+        self._bucket_name: str = bucket_name
+        self._top_n: int = top_n
+        self._processes: int = processes
+        self._threads: int = threads
+        self._max_jobs: int = max_jobs
+        self._threshold: float = threshold
+        self._jobs: OrderedDict = OrderedDict()
+        self._fingerprints: Dict[str, Fingerprint] = {}
+        self._lock = threading.Lock()
+        # The pools are created on first use, so that importing the app,
+        # and forking gunicorn workers, doesn't start any processes or threads.
+        self._process_pool: ProcessPoolExecutor = None
+        self._thread_pool: ThreadPoolExecutor = None
+
+    def submit(self, force: bool = False) -> WordCloudJob:
+        '''Starts a job, unless one is running. force regenerates every image.'''
+        with self._lock:
+            running = next((job for job in self._jobs.values() if job.running), None)
+            if running is not None:
+                return running
+
+            if self._thread_pool is None:
+                self._process_pool = ProcessPoolExecutor(self._processes)
+                self._thread_pool = ThreadPoolExecutor(self._threads, thread_name_prefix='wordcloud')
+            job = WordCloudJob()
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._max_jobs:
+                self._jobs.popitem(last=False)
+
+        logger.info(f'generate word cloud images, job {job.id}')
+        self._thread_pool.submit(self._start, job, force)
+        return job
+
+    def get(self, job_id: str) -> Optional[WordCloudJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _start(self, job: WordCloudJob, force: bool):
+        try:
+            pubs = list(self._data_storage.publications())
+        except Exception:
+            logger.exception(f'unable to list publications for job {job.id}')
+            job.fail()
+            return
+
+        job.start(len(pubs))
+        try:
+            for pub in pubs:
+                old = None if force else self._fingerprints.get(pub.name)
+                if old is not None and not count_changed(old.count, pub.count, self._threshold):
+                    job.publication_skipped(pub.name)
+                    continue
+                fetch = self._thread_pool.submit(self._fetch, pub.name)
+                self._chain(fetch, job, pub.name, lambda freqs, pub=pub, old=old: self._generate(job, pub, old, freqs))
+        except Exception:
+            logger.exception(f'unable to start generating word clouds for job {job.id}')
+            job.fail()
+
+    def _chain(self, future: Future, job: WordCloudJob, name: str, step):
+        '''Runs the next step with the future's result, or records the publication's failure.'''
+        def done(future: Future):
+            error = future.exception()
+            if error is not None:
+                logger.error(f'unable to generate the word cloud for {name}', exc_info=error)
+                job.publication_done(name, error)
+            elif step is None:
+                job.publication_done(name)
+            else:
+                # Errors raised by callbacks are only logged by the future,
+                # so they're recorded here, or the job would never finish.
+                try:
+                    step(future.result())
+                except Exception as ex:
+                    logger.exception(f'unable to generate the word cloud for {name}')
+                    job.publication_done(name, ex)
+        future.add_done_callback(done)
+
+    def _fetch(self, name: str) -> Dict[str, int]:
+        return self._data_storage.frequencies(name, self._top_n)
+
+    def _generate(self, job: WordCloudJob, pub: Publication, old: Optional[Fingerprint], freqs: Dict[str, int]):
+        new = Fingerprint(pub.count, frequencies_digest(freqs))
+        if old is not None and old.digest == new.digest:
+            self._fingerprints[pub.name] = new
+            job.publication_skipped(pub.name)
+            return
+        image = self._submit_image(freqs)
+        self._chain(image, job, pub.name, lambda ibytes: self._upload(job, pub, new, ibytes))
+
+    def _submit_image(self, freqs: Dict[str, int]) -> Future:
+        '''Generates the image on the process pool. Once a process in the pool
+        dies the pool is broken, and it's replaced so later images can be generated.
+        '''
+        pool = self._process_pool
+        try:
+            image = pool.submit(generate_word_cloud, freqs)
+        except BrokenProcessPool:
+            self._replace_process_pool(pool)
+            raise
+
+        def replace_if_broken(future: Future):
+            if isinstance(future.exception(), BrokenProcessPool):
+                self._replace_process_pool(pool)
+        image.add_done_callback(replace_if_broken)
+        return image
+
+    def _replace_process_pool(self, broken: ProcessPoolExecutor):
+        with self._lock:
+            if self._process_pool is not broken:
+                return
+            logger.error('the word cloud process pool is broken, replacing it')
+            self._process_pool = ProcessPoolExecutor(self._processes)
+        broken.shutdown(wait=False)
+
+    def _upload(self, job: WordCloudJob, pub: Publication, new: Fingerprint, ibytes: bytes):
+        upload = self._thread_pool.submit(self._save, pub.name, new, ibytes)
+        self._chain(upload, job, pub.name, None)
+
+    def _save(self, name: str, new: Fingerprint, ibytes: bytes):
+        self._blob_storage.save(name, self._bucket_name, ibytes)
+        # Only once it's uploaded, so a failed upload is retried by the next job.
+        self._fingerprints[name] = new
@@ -0,0 +1,224 @@
+import os
+import threading
+import time
+from unittest.mock import Mock
+from . import jobs
+from .data import NoOpDataStorage
+from .jobs import WordCloudJob, WordCloudJobRunner, count_changed, frequencies_digest
+from .models import Publication
+
+
+class RecordingBlobStorage:
+    '''Records the images saved, optionally blocking until released.'''
+
+    def __init__(self, fail=()):
+        self.saved = {}
+        self.fail = set(fail)
+        self.release = threading.Event()
+        self.release.set()
+
+    def save(self, publ, bucket_name, ibytes):
+        self.release.wait()
+        if publ in self.fail:
+            raise ConnectionError(publ)
+        self.saved[publ] = (bucket_name, ibytes)
+
+
+class FailingDataStorage(NoOpDataStorage):
+
+    def publications(self, bucket_name=None):
+        raise ConnectionError('database is unavailable')
+
+
+class ChangingDataStorage(NoOpDataStorage):
+    '''Publications whose counts and frequencies can be changed, counting fetches.'''
+
+    def __init__(self):
+        self.counts = {f'pub{i}': 100 for i in range(3)}
+        self.freqs = {name: {'ent0': 1, 'ent1': 2} for name in self.counts}
+        self.fetched = []
+
+    def publications(self, bucket_name=None):
+        for name, count in self.counts.items():
+            yield Publication(name, count, None)
+
+    def frequencies(self, publ, top_n=10, checkpoint=None):
+        self.fetched.append(publ)
+        return dict(self.freqs[publ])
+
+
+def wait(job, timeout=30):
+    deadline = time.monotonic() + timeout
+    while job.running and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return job.status()
+
+
+def test_job_progress():
+    job = WordCloudJob()
+    assert job.status()['state'] == 'running'
+    job.start(2)
+    job.publication_done('pub0')
+    assert job.status()['completed'] == 1
+    assert job.running
+    job.publication_done('pub1', ConnectionError())
+    status = job.status()
+    assert status['state'] == 'done'
+    assert status['failed'] == ['pub1']
+    assert status['finished'] is not None
+
+
+def test_job_without_publications_is_done():
+    job = WordCloudJob()
+    job.start(0)
+    assert job.status()['state'] == 'done'
+
+
+def test_runner_generates_every_publication():
+    blobs = RecordingBlobStorage()
+    runner = WordCloudJobRunner(blobs, NoOpDataStorage(), 'bucket', processes=2, threads=4)
+    job = runner.submit()
+    status = wait(job)
+    assert status['state'] == 'done'
+    assert status['total'] == status['completed'] == 10
+    assert sorted(blobs.saved) == [f'pub{i}' for i in range(10)]
+    bucket, ibytes = blobs.saved['pub0']
+    assert bucket == 'bucket'
+    assert ibytes.startswith(b'\x89PNG')
+    assert runner.get(job.id) is job
+
+
+def test_runner_returns_running_job():
+    blobs = RecordingBlobStorage()
+    blobs.release.clear()
+    runner = WordCloudJobRunner(blobs, NoOpDataStorage(), 'bucket', processes=1, threads=2)
+    job = runner.submit()
+    assert runner.submit() is job
+    blobs.release.set()
+    wait(job)
+    assert runner.submit() is not job
+
+
+def test_runner_records_failed_publications():
+    blobs = RecordingBlobStorage(fail={'pub3'})
+    runner = WordCloudJobRunner(blobs, NoOpDataStorage(), 'bucket', processes=1, threads=2)
+    status = wait(runner.submit())
+    assert status['state'] == 'done'
+    assert status['completed'] == 9
+    assert status['failed'] == ['pub3']
+
+
+def test_runner_fails_without_publications():
+    runner = WordCloudJobRunner(RecordingBlobStorage(), FailingDataStorage(), 'bucket', processes=1, threads=1)
+    status = wait(runner.submit())
+    assert status['state'] == 'failed'
+
+
+def test_runner_keeps_recent_jobs():
+    runner = WordCloudJobRunner(RecordingBlobStorage(), FailingDataStorage(), 'bucket', processes=1, threads=1,
+                                max_jobs=2)
+    jobs = []
+    for _ in range(3):
+        jobs.append(runner.submit())
+        wait(jobs[-1])
+    assert runner.get(jobs[0].id) is None
+    assert runner.get(jobs[2].id) is jobs[2]
+    assert runner.get('unknown') is None
+
+
+def test_frequencies_digest():
+    assert frequencies_digest({'a': 1, 'b': 2}) == frequencies_digest({'b': 2, 'a': 1})
+    assert frequencies_digest({'a': 1, 'b': 2}) != frequencies_digest({'a': 1, 'b': 3})
+
+
+def test_count_changed():
+    assert not count_changed(100, 100, 0)
+    assert count_changed(100, 101, 0)
+    assert not count_changed(100, 110, 0.1)
+    assert count_changed(100, 111, 0.1)
+    assert count_changed(0, 1, 0.5)
+
+
+def test_runner_regenerates_changed_publications():
+    blobs, data = RecordingBlobStorage(), ChangingDataStorage()
+    runner = WordCloudJobRunner(blobs, data, 'bucket', processes=1, threads=2)
+    status = wait(runner.submit())
+    assert (status['completed'], status['skipped']) == (3, 0)
+
+    # Nothing changed, so nothing is fetched or regenerated.
+    blobs.saved.clear()
+    data.fetched.clear()
+    status = wait(runner.submit())
+    assert (status['completed'], status['skipped']) == (0, 3)
+    assert data.fetched == [] and blobs.saved == {}
+
+    # pub1's count changed, but its frequencies didn't.
+    data.counts['pub1'] += 1
+    status = wait(runner.submit())
+    assert (status['completed'], status['skipped']) == (0, 3)
+    assert data.fetched == ['pub1'] and blobs.saved == {}
+
+    data.counts['pub2'] += 1
+    data.freqs['pub2']['ent2'] = 3
+    status = wait(runner.submit())
+    assert (status['completed'], status['skipped']) == (1, 2)
+    assert list(blobs.saved) == ['pub2']
+
+    status = wait(runner.submit(force=True))
+    assert (status['completed'], status['skipped']) == (3, 0)
+
+
+def test_runner_threshold():
+    blobs, data = RecordingBlobStorage(), ChangingDataStorage()
+    runner = WordCloudJobRunner(blobs, data, 'bucket', processes=1, threads=2, threshold=0.1)
+    wait(runner.submit())
+    data.counts['pub0'] += 10
+    data.counts['pub1'] += 11
+    for freqs in data.freqs.values():
+        freqs['ent2'] = 3
+    status = wait(runner.submit())
+    assert (status['completed'], status['skipped']) == (1, 2)
+
+
+def test_runner_retries_failed_uploads():
+    blobs, data = RecordingBlobStorage(fail={'pub0'}), ChangingDataStorage()
+    runner = WordCloudJobRunner(blobs, data, 'bucket', processes=1, threads=2)
+    status = wait(runner.submit())
+    assert status['failed'] == ['pub0']
+    blobs.fail.clear()
+    status = wait(runner.submit())
+    assert (status['completed'], status['skipped']) == (1, 2)
+    assert 'pub0' in blobs.saved
+
+
+def crashing_generate_word_cloud(freqs):
+    if 'crash' in freqs:
+        # Kills the pool's process, which breaks the pool.
+        os._exit(1)
+    return b'image'
+
+
+def test_runner_replaces_broken_process_pool(monkeypatch):
+    monkeypatch.setattr(jobs, 'generate_word_cloud', crashing_generate_word_cloud)
+    blobs, data = RecordingBlobStorage(), ChangingDataStorage()
+    data.freqs['pub1']['crash'] = 1
+    runner = WordCloudJobRunner(blobs, data, 'bucket', processes=1, threads=2)
+    job = runner.submit()
+    status = wait(job)
+    assert status['state'] == 'done'
+    assert 'pub1' in status['failed']
+
+    del data.freqs['pub1']['crash']
+    retry = runner.submit(force=True)
+    assert retry is not job
+    status = wait(retry)
+    assert (status['state'], status['completed']) == ('done', 3)
+
+
+def test_runner_records_failed_steps(monkeypatch):
+    blobs, data = RecordingBlobStorage(), ChangingDataStorage()
+    runner = WordCloudJobRunner(blobs, data, 'bucket', processes=1, threads=2)
+    monkeypatch.setattr(runner, '_submit_image', Mock(side_effect=RuntimeError()))
+    status = wait(runner.submit())
+    assert status['state'] == 'done'
+    assert sorted(status['failed']) == ['pub0', 'pub1', 'pub2']
@@ -22,8 +22,31 @@
     allowed_origin:         if set the value is used as the Access-Control-Allow-Origin header value
                             if not set the value is set to: *
 
+    data_cache_ttl:         if set to a number of seconds greater than 0 the data storage is wrapped with:
+                                CachedDataStorage(data_storage, ttl=data_cache_ttl)
+                            if not set query results aren't cached
+
+    data_cache_stale_ttl:   if set the value is the number of seconds stale results are served while refreshing
+                            if not set the value is set to: 300
+
+    data_cache_size:        if set the value is the max number of cached query results
+                            if not set the value is set to: 1024
+
+    json_serializer:        if set to a value of: orjson
+                            JSON responses are serialized with orjson, which requires: pip install ingestion[orjson]
+                            if not set the value is set to: json
+
+    gzip_responses:         if set to a value of: true
+                            JSON responses are gzip compressed for clients that accept it
+
+    wordcloud_threshold:    if set the value is the fraction a publication's count has to change by
+                            for its word cloud image to be regenerated
+                            if not set the value is set to: 0, any change regenerates the image
+
 '''
-from .data import BlobStorage, DataStorage, NoOpBlobStorage, NoOpDataStorage, generate_word_cloud, get_client
+from .data import BlobStorage, CachedDataStorage, DataStorage, NoOpBlobStorage, NoOpDataStorage, get_client
+from .jobs import WordCloudJobRunner
+from .streaming import get_serializer, gzip_chunks, json_array, peek
 import falcon
 from typing import Any, Dict, Generator, List, Tuple
 from collections import Counter, defaultdict
@@ -81,86 +104,119 @@ class CORSComponent(object):
             ))
 
 
+class JsonStream(object):
+    '''Streams JSON arrays as responses, gzip compressed if enabled
+    and the client accepts it.
+    '''
+
+    def __init__(self, serializer_name: str = 'json', gzip: bool = False):
+        self._serializer = get_serializer(serializer_name)
+        self._gzip = gzip
+
+    def respond(self, req, resp, items):
+        resp.content_type = falcon.MEDIA_JSON
+        chunks = json_array(items, self._serializer)
+        if self._gzip:
+            resp.append_header('Vary', 'Accept-Encoding')
+            if 'gzip' in (req.get_header('Accept-Encoding') or ''):
+                resp.set_header('Content-Encoding', 'gzip')
+                chunks = gzip_chunks(chunks)
+        resp.stream = chunks
+
+
 class PublicationsResource(object):
 
-    def __init__(self, data_storage: DataStorage, bucket_name: str):
+    def __init__(self, data_storage: DataStorage, bucket_name: str, json_stream: JsonStream = None):
         self._storage = data_storage
         self._bucket_name = bucket_name
+        self._json_stream = json_stream or JsonStream()
 
     def on_get(self, req, resp):
         try:
             publications = self._storage.publications(self._bucket_name)
-            resp.media = [p._asdict() for p in publications]
+            items = peek(p._asdict() for p in publications)
         except Exception as ex:
             logger.exception('unable to get publications')
             raise falcon.HTTPServiceUnavailable(
                 'Service Outage', 'database is unavailable', retry_after=30)
+        self._json_stream.respond(req, resp, items)
 
 
 class FrequenciesResource(object):
 
-    def __init__(self, data_storage: DataStorage):
+    def __init__(self, data_storage: DataStorage, json_stream: JsonStream = None):
         self._storage = data_storage
+        self._json_stream = json_stream or JsonStream()
 
     def on_get(self, req, resp, pub):
         try:
             # Get the parameters and configure a checkpoint
             chkpt = (req.get_param('word'), req.get_param_as_int('count'))
-            resp.media = [w._asdict() for w in self._storage.word_counts(pub, 10, chkpt)]  # noqa
+            items = peek(w._asdict() for w in self._storage.word_counts(pub, 10, chkpt))
         except Exception as ex:
             logger.exception('unable to get frequencies')
             raise falcon.HTTPServiceUnavailable(
                 'Service Outage', 'database is unavailable', retry_after=30)
+        self._json_stream.respond(req, resp, items)
 
 
 class WordCloudResource(object):
 
-    def __init__(self, blob_storage: BlobStorage, data_storage: DataStorage, bucket_name: str):
-        self._blob_storage = blob_storage
-        self._data_storage = data_storage
-        self._bucket_name = bucket_name
+    def __init__(self, jobs: WordCloudJobRunner):
+        self._jobs = jobs
 
     @falcon.before(can_generate_wordcloud, '8h45ty')
     def on_post(self, req, resp):
-        '''An easy, albeit inefficient way to generate all of the images. 
-        Effective enough for the intended use case.
-
-        NOTE: from(@sowhelmed): Problems with this code: 
-            1.) Gunicorn timeout will kill long running calls.
-            2.) Single CPU used for CPU bound image generation.
-            3.) Repeated calls likely result in a denial of service
+        '''Starts generating the images in the background, and responds
+        with the job's status. While a job is running, its status is returned
+        rather than starting another job.
+        Only the images of publications that changed are regenerated,
+        unless the force parameter is true.
         '''
         try:
-            logger.info('generate word cloud images')
-            for pub in self._data_storage.publications():
-                # Get frequencies for the top 5000 words
-                freqs = self._data_storage.frequencies(pub.name, 5000)
-                # Get the bytes for the image
-                ibytes = generate_word_cloud(freqs)
-                # Save to the blob storage in the given bucket
-                self._blob_storage.save(pub.name, self._bucket_name, ibytes)
-        except:
+            job = self._jobs.submit(force=req.get_param_as_bool('force', default=False))
+        except Exception:
             logger.exception('error generating wordclouds')
             raise falcon.HTTPServiceUnavailable(
                 'Service Outage', 'word cloud image generation unavailable', retry_after=30)
 
-        # Created!
-        resp.status = falcon.HTTP_201
+        # Accepted!
+        resp.status = falcon.HTTP_202
+        resp.location = f'/images/{job.id}'
+        resp.media = job.status()
+
+
+class WordCloudJobResource(object):
 
+    def __init__(self, jobs: WordCloudJobRunner):
+        self._jobs = jobs
 
-def _create_app(data_storage, blob_storage, blob_bucket_name, allowed_origin='*') -> falcon.API:
+    @falcon.before(can_generate_wordcloud, '8h45ty')
+    def on_get(self, req, resp, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise falcon.HTTPNotFound()
+        resp.media = job.status()
+
+
+def _create_app(data_storage, blob_storage, blob_bucket_name, allowed_origin='*',
+                wordcloud_threshold=0.0, json_serializer='json', gzip_responses=False) -> falcon.API:
     app = falcon.API(
         middleware=[
             CORSComponent(origin=allowed_origin),
         ]
     )
-    pubs = PublicationsResource(data_storage, blob_bucket_name)
-    freq = FrequenciesResource(data_storage)
-    wrdc = WordCloudResource(blob_storage, data_storage, blob_bucket_name)
+    json_stream = JsonStream(json_serializer, gzip_responses)
+    pubs = PublicationsResource(data_storage, blob_bucket_name, json_stream)
+    freq = FrequenciesResource(data_storage, json_stream)
+    jobs = WordCloudJobRunner(blob_storage, data_storage, blob_bucket_name, threshold=wordcloud_threshold)
+    wrdc = WordCloudResource(jobs)
+    wjob = WordCloudJobResource(jobs)
 
     app.add_route('/publications', pubs)
     app.add_route('/frequencies/{pub}', freq)
     app.add_route('/images', wrdc)
+    app.add_route('/images/{job_id}', wjob)
 
     return app
 
@@ -176,6 +232,15 @@ def create_app():
     else:
         data_storage = NoOpDataStorage()
 
+    data_cache_ttl = float(os.environ.get('data_cache_ttl') or 0)
+    if data_cache_ttl > 0:
+        data_storage = CachedDataStorage(
+            data_storage,
+            ttl=data_cache_ttl,
+            stale_ttl=float(os.environ.get('data_cache_stale_ttl') or 300),
+            max_entries=int(os.environ.get('data_cache_size') or 1024),
+        )
+
     if os.environ.get('blob_storage') == 'cloudstorage':
         blob_storage = BlobStorage(client=get_client('blob'))
     else:
@@ -183,8 +248,12 @@ def create_app():
 
     blob_bucket_name = os.environ.get('blob_storage_bucket', 'fake')
     allowed_origin = os.environ.get('allowed_origin', '*')
+    wordcloud_threshold = float(os.environ.get('wordcloud_threshold') or 0)
+    json_serializer = os.environ.get('json_serializer') or 'json'
+    gzip_responses = os.environ.get('gzip_responses') == 'true'
 
-    return _create_app(data_storage, blob_storage, blob_bucket_name, allowed_origin)
+    return _create_app(data_storage, blob_storage, blob_bucket_name, allowed_origin, wordcloud_threshold,
+                       json_serializer, gzip_responses)
 
 
 def simple_app(environ, start_response):
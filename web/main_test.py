@@ -1,10 +1,13 @@
 from unittest.mock import patch
+import gzip
+import json
 import os
+import time
 import pytest
 from falcon import testing
 from collections import OrderedDict
-from .data import NoOpBlobStorage, NoOpDataStorage, DataStorage, BlobStorage
-from .main import create_app
+from .data import NoOpBlobStorage, NoOpDataStorage, CachedDataStorage, DataStorage, BlobStorage
+from .main import _create_app as create_test_app, create_app
 
 
 @pytest.fixture()
@@ -18,7 +21,10 @@ noop_environvars = OrderedDict({
     'data_storage': ('', NoOpDataStorage),
     'blob_storage': ('', NoOpBlobStorage),
     'blob_storage_bucket': ('', str),
-    'allowed_origin': ('', str)
+    'allowed_origin': ('', str),
+    'wordcloud_threshold': ('', float),
+    'json_serializer': ('', str),
+    'gzip_responses': ('', bool),
 })
 
 
@@ -39,6 +45,14 @@ def test_create_app_noop_return_types(monkeypatch):
     create_app()
 
 
+def test_create_app_data_cache(monkeypatch):
+    monkeypatch.setenv('data_storage', '')
+    monkeypatch.setenv('data_cache_ttl', '30')
+    with patch(f'{__package__}.main._create_app') as mock:
+        create_app()
+    assert isinstance(mock.call_args[0][0], CachedDataStorage)
+
+
 def test_get_publications(client):
     result = client.simulate_get('/publications')
     assert result.status_code == 200
@@ -69,6 +83,38 @@ def test_get_frequencies_with_params(client):
         assert prop in result.json[0]
 
 
+def test_get_publications_gzip(monkeypatch):
+    monkeypatch.setenv('gzip_responses', 'true')
+    monkeypatch.setenv('json_serializer', 'orjson')
+    client = testing.TestClient(create_app())
+    result = client.simulate_get('/publications', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert result.status_code == 200
+    assert result.headers.get('Content-Encoding') == 'gzip'
+    assert result.headers.get('Vary') == 'Accept-Encoding'
+    assert len(json.loads(gzip.decompress(result.content))) == 10
+
+    result = client.simulate_get('/frequencies/pub0')
+    assert result.headers.get('Content-Encoding') is None
+    assert len(result.json) == 10
+
+
+class FailingDataStorage(NoOpDataStorage):
+
+    def publications(self, bucket_name=None):
+        raise ConnectionError()
+        yield
+
+    def word_counts(self, publ, top_n=10, checkpoint=None):
+        raise ConnectionError()
+        yield
+
+
+def test_get_unavailable():
+    client = testing.TestClient(create_test_app(FailingDataStorage(), NoOpBlobStorage(), 'fake'))
+    assert client.simulate_get('/publications').status_code == 503
+    assert client.simulate_get('/frequencies/pub0').status_code == 503
+
+
 def test_post_images_unauthorized(client):
     result = client.simulate_post(f'/images')
     assert result.headers.get('Access-Control-Allow-Origin') == '*'
@@ -78,4 +124,26 @@ def test_post_images_unauthorized(client):
 def test_post_images(client):
     result = client.simulate_post(f'/images', headers={'Authorization': '8h45ty'})  # noqa
     assert result.headers.get('Access-Control-Allow-Origin') == '*'
-    assert result.status_code == 201
+    assert result.status_code == 202
+    assert result.json['state'] in ('running', 'done')
+    assert result.headers.get('Location').endswith(f"/images/{result.json['id']}")
+
+    deadline = time.monotonic() + 30
+    status = result.json
+    while status['state'] == 'running' and time.monotonic() < deadline:
+        time.sleep(0.05)
+        progress = client.simulate_get(f"/images/{status['id']}", headers={'Authorization': '8h45ty'})  # noqa
+        assert progress.status_code == 200
+        status = progress.json
+    assert status['state'] == 'done'
+    assert status['completed'] == 10
+
+
+def test_get_image_job_unknown(client):
+    result = client.simulate_get(f'/images/unknown', headers={'Authorization': '8h45ty'})  # noqa
+    assert result.status_code == 404
+
+
+def test_get_image_job_unauthorized(client):
+    result = client.simulate_get(f'/images/unknown')
+    assert result.status_code == 403
@@ -0,0 +1,87 @@
+'''
+    Streams JSON responses, so that large results are sent as they're read
+    from the data storage, rather than built in memory first.
+
+    An array is serialized an item at a time, and items are buffered into
+    chunks of about chunk_size bytes before they're yielded to the server.
+    Chunks can be gzip compressed as they're streamed.
+
+    Serializers:
+        json:       part of the standard library.
+        orjson:     faster. Requires: pip install ingestion[orjson]
+'''
+import itertools
+import json
+import zlib
+from typing import Any, Iterable, Iterator
+
+
+class JsonSerializer(object):
+    name = 'json'
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+
+class OrjsonSerializer(object):
+    name = 'orjson'
+
+    def __init__(self):
+        try:
+            import orjson  # noqa
+        except ImportError:
+            raise ImportError('the orjson serializer requires: pip install ingestion[orjson]')
+
+    def dumps(self, obj: Any) -> bytes:
+        import orjson
+        return orjson.dumps(obj)
+
+
+SERIALIZERS = {serializer.name: serializer for serializer in (JsonSerializer, OrjsonSerializer)}
+
+
+def get_serializer(name: str):
+    '''Returns an instance of the named serializer.'''
+    try:
+        return SERIALIZERS[name]()
+    except KeyError:
+        raise ValueError(f'unknown serializer, expected one of: {list(SERIALIZERS)}')
+
+
+def json_array(items: Iterable[Any], serializer=None, chunk_size: int = 16 * 1024) -> Iterator[bytes]:
+    '''Yields the items as a JSON array, in chunks of about chunk_size bytes.'''
+    dumps = (serializer or JsonSerializer()).dumps
+    chunk, size = [b'['], 1
+    for i, item in enumerate(items):
+        data = dumps(item)
+        if i:
+            chunk.append(b',')
+        chunk.append(data)
+        size += len(data) + 1
+        if size >= chunk_size:
+            yield b''.join(chunk)
+            chunk, size = [], 0
+    chunk.append(b']')
+    yield b''.join(chunk)
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    '''Yields each chunk gzip compressed.
+    Each chunk is flushed, so the client can decompress it as soon as it arrives.
+    '''
+    # wbits of 31 writes the gzip header and trailer.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def peek(items: Iterable[Any]) -> Iterator[Any]:
+    '''Returns an iterator of the items, after getting the first one.
+    Errors starting a query are raised by peek, while the response
+    can still report them, rather than once it's being streamed.
+    '''
+    items = iter(items)
+    for first in items:
+        return itertools.chain([first], items)
+    return iter(())
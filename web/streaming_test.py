@@ -0,0 +1,53 @@
+import gzip
+import json
+import pytest
+from .streaming import JsonSerializer, OrjsonSerializer, get_serializer, gzip_chunks, json_array, peek
+
+
+def test_get_serializer():
+    assert isinstance(get_serializer('json'), JsonSerializer)
+    assert isinstance(get_serializer('orjson'), OrjsonSerializer)
+    with pytest.raises(ValueError):
+        get_serializer('yaml')
+
+
+@pytest.mark.parametrize('name', ['json', 'orjson'])
+def test_json_array(name):
+    items = [{'word': f'ent{i}', 'count': i} for i in range(1000)]
+    chunks = list(json_array(iter(items), get_serializer(name), chunk_size=1024))
+    assert len(chunks) > 1
+    assert all(len(chunk) < 1024 + 64 for chunk in chunks)
+    assert json.loads(b''.join(chunks)) == items
+
+
+def test_json_array_empty():
+    assert json.loads(b''.join(json_array(iter(())))) == []
+
+
+def test_json_array_is_lazy():
+    def items():
+        yield {'count': 0}
+        raise ConnectionError()
+
+    chunks = json_array(items(), chunk_size=1)
+    assert next(chunks) == b'[{"count":0}'
+    with pytest.raises(ConnectionError):
+        next(chunks)
+
+
+def test_gzip_chunks():
+    chunks = [b'[', b'{"count":0}', b']']
+    compressed = list(gzip_chunks(chunks))
+    assert gzip.decompress(b''.join(compressed)) == b''.join(chunks)
+
+
+def test_peek():
+    assert list(peek(iter([1, 2, 3]))) == [1, 2, 3]
+    assert list(peek(iter(()))) == []
+
+    def failing():
+        raise ConnectionError()
+        yield
+
+    with pytest.raises(ConnectionError):
+        peek(failing())